@@ -4,7 +4,7 @@ import sys
 import subprocess
 import argparse
 
-def run_tests(module=None, verbose=False, coverage=False):
+def run_tests(module=None, verbose=False, coverage=False, workers=None):
     """Run pytest with specified options"""
     print("=" * 80)
     print("RUNNING WEB CRAWLER TESTS")
@@ -28,6 +28,11 @@ def run_tests(module=None, verbose=False, coverage=False):
     if coverage:
         cmd.extend(["--cov=scrapers", "--cov=utils", "--cov-report", "term"])
     
+    # Spread tests across worker processes (requires pytest-xdist); tests
+    # marked with the same xdist_group stay on one worker
+    if workers:
+        cmd.extend(["-n", workers, "--dist", "loadgroup"])
+    
     # Add specific module if provided
     if module:
         if not module.startswith("tests/"):
@@ -45,6 +50,7 @@ if __name__ == "__main__":
     parser.add_argument("-m", "--module", help="Specific test module to run (e.g. 'scrapers/sites/test_facebook.py')")
     parser.add_argument("-v", "--verbose", action="store_true", help="Run tests with verbose output")
     parser.add_argument("-c", "--coverage", action="store_true", help="Run tests with coverage report")
+    parser.add_argument("-n", "--workers", help="Run tests in parallel across N processes, or 'auto' for one per CPU")
     
     args = parser.parse_args()
     
@@ -52,4 +58,4 @@ if __name__ == "__main__":
     os.makedirs("tests/temp", exist_ok=True)
     os.makedirs("tests/temp/screenshots", exist_ok=True)
     
-    sys.exit(run_tests(args.module, args.verbose, args.coverage)) 
\ No newline at end of file
+    sys.exit(run_tests(args.module, args.verbose, args.coverage, args.workers)) 
\ No newline at end of file
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from loguru import logger
+
+def iter_site_results(query, scrapers, **filters):
+    """
+    Search several sites concurrently, yielding each site's results as it finishes
+
+    Each scraper's search() call runs on its own worker thread. Results come
+    back in completion order, so callers can report progress per site instead
+    of waiting for the slowest one.
+
+    Args:
+        query (str): Search keywords
+        scrapers (dict): Mapping of site name to scraper instance
+        **filters: Keyword filters passed through to every search() call
+            (max_price, condition, location)
+
+    Yields:
+        tuple: (site name, list of products), with an empty list if the scraper failed
+    """
+    with ThreadPoolExecutor(max_workers=max(len(scrapers), 1)) as executor:
+        futures = {
+            executor.submit(scraper.search, query, **filters): name
+            for name, scraper in scrapers.items()
+        }
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                site_results = future.result()
+            except Exception as e:
+                # Log but continue with other scrapers
+                logger.error(f"Error with {name} scraper: {e}")
+                site_results = []
+            yield name, site_results
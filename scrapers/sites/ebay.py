@@ -3,7 +3,10 @@ import time
 import requests
 from bs4 import BeautifulSoup
 import re
-from utils.config import USER_AGENTS, REQUEST_DELAY_MIN, REQUEST_DELAY_MAX
+from utils.config import pick_user_agent, REQUEST_DELAY_MIN, REQUEST_DELAY_MAX
+
+# First dollar amount in a price label, e.g. "$1,299.99" or "$10.00 to $20.00"
+PRICE_PATTERN = re.compile(r'\$?\s*([0-9][0-9,]*(?:\.[0-9]+)?)')
 
 class EbayScraper:
     def __init__(self):
@@ -50,7 +53,7 @@ class EbayScraper:
         
         # Make the request with randomly selected user agent
         headers = {
-            "User-Agent": random.choice(USER_AGENTS),
+            "User-Agent": pick_user_agent(),
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
             "Accept-Language": "en-US,en;q=0.5",
             "Accept-Encoding": "gzip, deflate, br",
@@ -89,7 +92,7 @@ class EbayScraper:
         if not products:
             try:
                 # Use a different user agent for the backup request
-                headers["User-Agent"] = random.choice(USER_AGENTS)
+                headers["User-Agent"] = pick_user_agent()
                 
                 # Add a longer delay before the backup request
                 time.sleep(random.uniform(REQUEST_DELAY_MAX, REQUEST_DELAY_MAX * 2))
@@ -214,7 +217,9 @@ class EbayScraper:
             if title.lower() == 'shop on ebay' or not title:
                 return None
                 
-            price = price_elem.text.strip() if price_elem else "N/A"
+            price = self._coerce_price(price_elem.text)
+            if price is None:
+                return None
             url = link_elem['href'] if link_elem else None
             condition = condition_elem.text.strip() if condition_elem else "Not specified"
             shipping = shipping_elem.text.strip() if shipping_elem else "Not specified"
@@ -231,4 +236,19 @@ class EbayScraper:
             }
         except Exception as e:
             print(f"Error in _parse_product: {e}")
-            return None 
\ No newline at end of file
+            return None
+    
+    def _coerce_price(self, price_text):
+        """
+        Convert an eBay price label into a float
+        
+        Args:
+            price_text (str): Price text such as "$99.99" or "$10.00 to $20.00"
+            
+        Returns:
+            float: The (lowest) price, or None if no amount could be found
+        """
+        price_match = PRICE_PATTERN.search(price_text)
+        if not price_match:
+            return None
+        return float(price_match.group(1).replace(',', ''))
@@ -1,11 +1,10 @@
-import random
 import time
 import requests
 from bs4 import BeautifulSoup
 import re
 from loguru import logger
 from playwright.sync_api import sync_playwright
-from utils.config import USER_AGENTS, REQUEST_DELAY_MIN, REQUEST_DELAY_MAX, FB_CREDENTIALS
+from utils.config import pick_user_agent, REQUEST_DELAY_MIN, REQUEST_DELAY_MAX, FB_CREDENTIALS
 from utils.logging_setup import SCREENSHOT_PATH
 
 import os
@@ -69,7 +68,7 @@ class FacebookMarketplaceScraper:
                         '--disable-site-isolation-trials',
                     ],
                     viewport={"width": 1280, "height": 800},
-                    user_agent=random.choice(USER_AGENTS),
+                    user_agent=pick_user_agent(),
                     locale='en-US'
                 )
                 
@@ -9,7 +9,7 @@ import webbrowser
 import os
 from pathlib import Path
 from playwright.sync_api import sync_playwright
-from utils.config import USER_AGENTS, REQUEST_DELAY_MIN, REQUEST_DELAY_MAX
+from utils.config import pick_user_agent, REQUEST_DELAY_MIN, REQUEST_DELAY_MAX
 from utils.logging_setup import SCREENSHOT_PATH, HTML_PATH  # Import screenshot path
 
 class NeweggScraper:
@@ -33,22 +33,7 @@ class NeweggScraper:
             list: List of product dictionaries
         """
         try:
-            # Format the search URL with parameters
-            url = f"{self.base_url}{'+'.join(keywords.split())}"
-            
-            # Add price filter if specified
-            if max_price:
-                url += f"&Price=%7B0%7D+TO+{max_price}"
-                
-            # Add condition filter if specified
-            if condition:
-                if condition.lower() == "new":
-                    url += "&N=100167671"  # New items filter
-                elif condition.lower() == "refurbished":
-                    url += "&N=100167670"  # Refurbished items filter
-                # Note: Newegg doesn't have a specific "used" filter, but we can use "open box"
-                elif condition.lower() == "used":
-                    url += "&N=100167669"  # Open Box items filter
+            url = self._build_search_url(keywords, max_price=max_price, condition=condition)
             
             logger.info(f"Searching Newegg with URL: {url}")
             
@@ -65,11 +50,42 @@ class NeweggScraper:
             logger.error(f"Error in Newegg search: {e}")
             return []
     
+    def _build_search_url(self, keywords, max_price=None, condition=None):
+        """
+        Build the Newegg search URL for the given keywords and filters
+        
+        Args:
+            keywords (str): Search keywords
+            max_price (float, optional): Maximum price filter
+            condition (str, optional): Product condition (new, used, refurbished)
+            
+        Returns:
+            str: Search URL
+        """
+        # Format the search URL with parameters
+        url = f"{self.base_url}{'+'.join(keywords.split())}"
+        
+        # Add price filter if specified
+        if max_price:
+            url += f"&Price=%7B0%7D+TO+{max_price}"
+            
+        # Add condition filter if specified
+        if condition:
+            if condition.lower() == "new":
+                url += "&N=100167671"  # New items filter
+            elif condition.lower() == "refurbished":
+                url += "&N=100167670"  # Refurbished items filter
+            # Note: Newegg doesn't have a specific "used" filter, but we can use "open box"
+            elif condition.lower() == "used":
+                url += "&N=100167669"  # Open Box items filter
+        
+        return url
+    
     def _try_regular_request(self, url):
         """Try to search with a regular HTTP request first"""
         # Make the request with randomly selected user agent
         headers = {
-            "User-Agent": random.choice(USER_AGENTS),
+            "User-Agent": pick_user_agent(),
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
             "Accept-Language": "en-US,en;q=0.5",
             "Accept-Encoding": "gzip, deflate, br",
@@ -1,27 +1,38 @@
 import os
-import sys
 import pytest
 import json
 from pathlib import Path
 from unittest.mock import patch, MagicMock
+import requests
+import responses
 from playwright.sync_api import sync_playwright
 
-# Add project root to Python path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+@pytest.fixture(autouse=True)
+def block_external_http(monkeypatch):
+    """Fail any HTTP request that slips past the mocks, so tests stay offline"""
+    def refuse(adapter, http_request, *args, **kwargs):
+        raise requests.exceptions.ConnectionError(
+            f"Unmocked HTTP request in test: {http_request.method} {http_request.url}"
+        )
+    
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", refuse)
 
 # Create a mocked test environment
 @pytest.fixture(scope="session")
-def test_env():
-    """Set up test environment variables and directories"""
+def test_env(tmp_path_factory):
+    """Set up test environment variables and directories
+    
+    Yields the temp directory for test file output. It comes from
+    tmp_path_factory, so each pytest-xdist worker gets its own.
+    """
     # Create test directories
-    test_dir = Path("tests/temp")
-    test_dir.mkdir(exist_ok=True)
+    test_dir = tmp_path_factory.mktemp("temp")
     
-    test_screenshot_dir = Path("tests/temp/screenshots")
-    test_screenshot_dir.mkdir(exist_ok=True)
+    test_screenshot_dir = test_dir / "screenshots"
+    test_screenshot_dir.mkdir()
     
-    test_user_data_dir = Path("tests/temp/user_data")
-    test_user_data_dir.mkdir(exist_ok=True)
+    test_user_data_dir = test_dir / "user_data"
+    test_user_data_dir.mkdir()
     
     # Mock environment variables
     with patch.dict(os.environ, {
@@ -29,7 +40,7 @@ def test_env():
         "FB_EMAIL": "test@example.com",
         "FB_PASSWORD": "test_password"
     }):
-        yield
+        yield test_dir
     
     # Cleanup can be added here if needed
 
@@ -133,6 +144,17 @@ def mock_sync_playwright():
     with patch('playwright.sync_api.sync_playwright', return_value=MockPlaywright()):
         yield MockPlaywright()
 
+@pytest.fixture
+def mock_http():
+    """Stub HTTP at the transport layer so real scrapers run without network access
+    
+    Register responses with e.g. mock_http.get(url, body=html); any request that
+    wasn't registered raises ConnectionError. Request delays are skipped.
+    """
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps, \
+         patch('time.sleep'):
+        yield rsps
+
 @pytest.fixture
 def sample_html_responses():
     """Load sample HTML responses for testing"""
@@ -108,12 +108,20 @@ class TestEbayScraper:
         
         # Verify product data was extracted correctly
         assert product["title"] == "Test Product"
-        assert product["price"] == "$99.99"
+        assert product["price"] == 99.99
         assert product["shipping"] == "Free shipping"
         assert product["condition"] == "Used"
         assert product["url"] == "https://www.ebay.com/item/123456"
         assert product["image"] == "https://example.com/image.jpg"
     
+    def test_coerce_price(self, scraper):
+        """Test that price labels are converted to floats"""
+        assert scraper._coerce_price("$99.99") == 99.99
+        assert scraper._coerce_price("$1,299.00") == 1299.0
+        # Price ranges use the lowest price
+        assert scraper._coerce_price("$10.00 to $20.00") == 10.0
+        assert scraper._coerce_price("See price") is None
+    
     def test_search_applies_filters(self, scraper, mock_response, monkeypatch):
         """Test that search applies filters correctly"""
         # Mock requests.get
@@ -15,8 +15,8 @@ class TestFacebookMarketplaceScraper:
         """Create a scraper instance for testing"""
         scraper = FacebookMarketplaceScraper()
         # Override paths for testing
-        scraper.cookies_file = "tests/temp/fb_cookies.json"
-        scraper.user_data_dir = os.path.abspath("tests/temp/fb_user_data")
+        scraper.cookies_file = str(test_env / "fb_cookies.json")
+        scraper.user_data_dir = str(test_env / "fb_user_data")
         return scraper
     
     @pytest.fixture
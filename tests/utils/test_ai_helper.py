@@ -1,32 +1,92 @@
 import pytest
-from unittest.mock import patch, MagicMock
-import json
-import sys
 import os
-from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
-
-# Add the parent directory to the path to import modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import asyncio
+import functools
+from unittest.mock import patch, AsyncMock
+import json
+from types import SimpleNamespace
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted, ServiceUnavailable
+from tenacity import wait_none
+import google.generativeai as genai
+from utils.rate_limit import TokenBucket
 
 from utils.ai_helper import (
     parse_user_query,
+    parse_user_query_async,
     rank_recommendations,
+    rank_recommendations_async,
+    rank_recommendations_batch,
     _parse_ai_response,
     _extract_json_from_text,
     _ensure_complete_structure,
     _create_fallback_query_structure,
+    _get_model,
+    _generate_streamed,
+    _CircuitBreaker,
+    _call_model,
+    _sdk_loop,
+    _BREAKERS,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS,
+    RANKING_BATCH_SIZE,
+    _RANK_RESPONSE_SCHEMA,
+    _QUERY_RESPONSE_SCHEMA,
 )
 
+# Canned model output for test_rank_recommendations, serialized once for the
+# mocked responses' text
+_RANK_RESULT = [
+    {"id": 0, "score": 95, "reason": "Matches RAM requirement, Good price"},
+    {"id": 1, "score": 80, "reason": "Lower specs, Good price"}
+]
+_RANK_RESULT_TEXT = json.dumps(_RANK_RESULT)
+
+def _prompt_ids(prompt):
+    """Get the product ids from the table in a ranking prompt"""
+    table = prompt.split("id|title|price|condition\n", 1)[1]
+    return [int(row.split("|", 1)[0]) for row in table.splitlines() if row.strip()]
+
+class _StreamedResponse(SimpleNamespace):
+    """Stand-in for a streamed model response, delivered as a single chunk"""
+    async def __aiter__(self):
+        yield self
+
 class TestAIHelper:
+    @pytest.fixture(autouse=True)
+    def no_retry_wait(self):
+        """Retry transient API errors without the real backoff delay"""
+        with patch.object(_generate_streamed.retry, "wait", wait_none()):
+            yield
+
+    @pytest.fixture(autouse=True)
+    def no_rate_limit(self):
+        """Don't pace the mocked model calls"""
+        with patch('utils.ai_helper._GEMINI_LIMITER', TokenBucket(rpm=10**9)):
+            yield
+
+    @pytest.fixture(autouse=True)
+    def fresh_breakers(self):
+        """Start every test with closed circuit breakers"""
+        with patch.dict('utils.ai_helper._BREAKERS', {name: _CircuitBreaker() for name in _BREAKERS}):
+            yield
+
+    @pytest.fixture(autouse=True)
+    def clear_caches(self):
+        """Keep memoized parses and (possibly mocked) models from leaking between tests"""
+        parse_user_query.cache_clear()
+        _get_model.cache_clear()
+        yield
+        parse_user_query.cache_clear()
+        _get_model.cache_clear()
+
     @pytest.fixture
     def mock_genai_model(self):
         """Mock the Gemini model for testing"""
         with patch('utils.ai_helper.genai.GenerativeModel') as mock_model:
-            # Mock the generate_content method
+            # Mock the generate_content_async method
             mock_instance = mock_model.return_value
-            mock_response = MagicMock()
-            mock_response.text = '{"product_type": "laptop", "product_category": "computer", "features": {"ram": "16GB", "storage": "512GB SSD"}, "attributes": {"ram": "16GB", "storage": "512GB SSD"}, "price_range": {"min": 0, "max": 1500}, "query_text": "I need a laptop with 16GB RAM"}'
-            mock_instance.generate_content.return_value = mock_response
+            mock_response = _StreamedResponse(text='{"product_type": "laptop", "product_category": "computer", "features": {"ram": "16GB", "storage": "512GB SSD"}, "attributes": {"ram": "16GB", "storage": "512GB SSD"}, "price_range": {"min": 0, "max": 1500}, "query_text": "I need a laptop with 16GB RAM"}')
+            mock_instance.generate_content_async = AsyncMock(return_value=mock_response)
             yield mock_instance
 
     def test_parse_user_query_success(self, mock_genai_model):
@@ -40,9 +100,12 @@ class TestAIHelper:
         assert result["attributes"]["storage"] == "512GB SSD"
         
         # Verify model was called with appropriate prompt
-        call_args = mock_genai_model.generate_content.call_args[0][0]
+        call_args = mock_genai_model.generate_content_async.call_args[0][0]
         assert "Parse this user query" in call_args
         assert "I need a laptop with 16GB RAM" in call_args
+        
+        # The response is requested as a stream
+        assert mock_genai_model.generate_content_async.call_args.kwargs["stream"] is True
 
     def test_parse_user_query_with_budget(self, mock_genai_model):
         """Test parsing a user query with budget"""
@@ -50,17 +113,241 @@ class TestAIHelper:
         result = parse_user_query("I need a laptop with 16GB RAM", budget=1000)
         
         # Verify budget was included in the prompt
-        call_args = mock_genai_model.generate_content.call_args[0][0]
+        call_args = mock_genai_model.generate_content_async.call_args[0][0]
         assert "budget" in call_args.lower()
         assert "1000" in call_args
 
+    def test_parse_user_query_caches_successful_results(self, mock_genai_model):
+        """Test that repeat queries are served from the cache"""
+        first = parse_user_query("I need a laptop with 16GB RAM", budget=1500)
+        second = parse_user_query("I need a laptop with 16GB RAM", budget=1500)
+        
+        # The model is only queried once for identical inputs
+        assert mock_genai_model.generate_content_async.call_count == 1
+        assert first == second
+        
+        # Mutating a returned result must not affect the cached entry
+        first["attributes"]["ram"] = "32GB"
+        assert parse_user_query("I need a laptop with 16GB RAM", budget=1500)["attributes"]["ram"] == "16GB"
+        
+        # A different budget is a different cache key
+        parse_user_query("I need a laptop with 16GB RAM", budget=2000)
+        assert mock_genai_model.generate_content_async.call_count == 2
+
+    def test_parse_user_query_async(self, mock_genai_model):
+        """Test that the async parser can run alongside other coroutines"""
+        async def run():
+            return await asyncio.gather(
+                parse_user_query_async("I need a laptop with 16GB RAM", budget=1000),
+                asyncio.sleep(0, result="other work")
+            )
+        
+        result, other = asyncio.run(run())
+        
+        assert result["product_type"] == "laptop"
+        assert result["success"] is True
+        assert other == "other work"
+        mock_genai_model.generate_content_async.assert_awaited_once()
+
+    def test_parse_user_query_cache_is_lru_and_shared_with_async(self, mock_genai_model):
+        """Test cache statistics, eviction order, and that the async parser uses the same cache"""
+        with patch('utils.ai_helper.QUERY_CACHE_SIZE', 2):
+            parse_user_query("laptop one")
+            parse_user_query("laptop two")
+            parse_user_query("laptop one")  # hit; "laptop two" is now least recently used
+            parse_user_query("laptop three")  # evicts "laptop two"
+            asyncio.run(parse_user_query_async("laptop one"))  # hit
+            
+            info = parse_user_query.cache_info()
+            assert (info.hits, info.misses, info.maxsize, info.currsize) == (2, 3, 2, 2)
+            
+            parse_user_query("laptop two")
+            assert mock_genai_model.generate_content_async.call_count == 4
+
+    def test_parse_user_query_reuses_reworded_query(self, mock_genai_model):
+        """Test that a reworded query with the same words, numbers and budget hits the cache"""
+        parse_user_query("I need a gaming laptop under 1200", budget=1200)
+        
+        result = parse_user_query("looking for gaming laptop under 1200 please", budget=1200)
+        assert mock_genai_model.generate_content_async.call_count == 1
+        assert result["query_text"] == "looking for gaming laptop under 1200 please"
+        
+        # A different number or budget is a different request
+        parse_user_query("gaming laptop under 1500", budget=1200)
+        parse_user_query("gaming laptop under 1200", budget=1500)
+        assert mock_genai_model.generate_content_async.call_count == 3
+
+    @pytest.mark.parametrize("cached, query", [
+        pytest.param("asus gaming laptop under 1000", "msi gaming laptop under 1000", id="brand"),
+        pytest.param("macbook air m2", "macbook pro m2", id="model"),
+        pytest.param("laptop under 1000", "laptop around 1000", id="price-intent"),
+        pytest.param("cheap laptop", "laptop", id="cheap"),
+    ])
+    def test_parse_user_query_does_not_reuse_other_products(self, mock_genai_model, cached, query):
+        """Test that queries differing in a brand, model or price word are not served each other's parse"""
+        parse_user_query(cached, budget=1000)
+        
+        parse_user_query(query, budget=1000)
+        assert mock_genai_model.generate_content_async.call_count == 2
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_parse_user_query_uses_response_schema(self, mock_model):
+        """Test that query parses request the schema and read its JSON text, features pairs included"""
+        mock_model.return_value.generate_content_async = AsyncMock(return_value=_StreamedResponse(text=json.dumps({
+            "product_category": "laptop",
+            "product_type": "gaming laptop",
+            "features": [{"name": "ram", "value": "16GB"}, {"name": "graphics", "value": "RTX 3060"}],
+            "keywords": ["gaming laptop"]
+        })))
+        
+        result = parse_user_query("gaming laptop with 16GB and an RTX 3060")
+        
+        assert result["success"] is True
+        assert result["features"] == {"ram": "16GB", "graphics": "RTX 3060"}
+        config = mock_model.return_value.generate_content_async.call_args.kwargs["generation_config"]
+        if "response_schema" in genai.types.GenerationConfig.__dataclass_fields__:
+            assert config["response_mime_type"] == "application/json"
+            assert config["response_schema"] == _QUERY_RESPONSE_SCHEMA
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_models_are_created_once(self, mock_model):
+        """Test that each GenerativeModel is built once and reused across calls and event loops"""
+        mock_model.return_value.generate_content_async = AsyncMock(return_value=_StreamedResponse(text='{"product_type": "laptop"}'))
+        
+        parse_user_query("laptop")
+        asyncio.run(parse_user_query_async("phone"))
+        
+        mock_model.assert_called_once_with("gemini-2.0-flash")
+        assert mock_model.return_value.generate_content_async.call_count == 2
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_parse_user_query_runs_on_sdk_loop(self, mock_model):
+        """Test that sync parses all run on the one long-lived SDK event loop"""
+        loops = []
+        
+        async def generate(*args, **kwargs):
+            loops.append(asyncio.get_running_loop())
+            return _StreamedResponse(text='{"product_type": "laptop"}')
+        
+        mock_model.return_value.generate_content_async = generate
+        
+        assert parse_user_query("laptop")["success"] is True
+        assert parse_user_query("phone")["success"] is True
+        assert loops == [_sdk_loop()] * 2
+
+    def test_sdk_client_survives_consecutive_sync_calls(self, monkeypatch):
+        """Test that the real SDK client still works after a sync call's loop has finished"""
+        # A real client pointed at a closed local port: every call fails to
+        # connect, but should do so with the SDK's error, not a closed loop
+        genai.configure(api_key="test_api_key", client_options={"api_endpoint": "127.0.0.1:9"})
+        monkeypatch.setattr(
+            genai.GenerativeModel, "generate_content_async",
+            functools.partialmethod(genai.GenerativeModel.generate_content_async, request_options={"retry": None})
+        )
+        errors = []
+        real_call_model = _call_model
+        
+        async def recording_call_model(*args, **kwargs):
+            try:
+                return await real_call_model(*args, **kwargs)
+            except Exception as e:
+                errors.append(e)
+                raise
+        
+        try:
+            with patch('utils.ai_helper._call_model', recording_call_model):
+                parse_user_query("gaming laptop")
+                rank_recommendations([{"title": f"Laptop {i}", "price": 500 + i} for i in range(4)], {"product_type": "laptop"})
+        finally:
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        
+        # Both calls tried the primary and then the fallback model
+        assert len(errors) == 4
+        assert all(isinstance(e, ServiceUnavailable) for e in errors)
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_transient_errors_are_retried_before_fallback(self, mock_model):
+        """Test that quota errors are retried on the primary model and other errors are not"""
+        success = _StreamedResponse(text='{"product_type": "laptop"}')
+        mock_model.return_value.generate_content_async = AsyncMock(
+            side_effect=[ResourceExhausted("quota"), ServiceUnavailable("busy"), success]
+        )
+        
+        result = parse_user_query("laptop")
+        
+        assert result["success"] is True
+        assert mock_model.return_value.generate_content_async.call_count == 3
+        mock_model.assert_called_once_with("gemini-2.0-flash")
+        
+        # A non-retryable error goes straight to the fallback model
+        mock_model.return_value.generate_content_async = AsyncMock(side_effect=[InvalidArgument("bad"), success])
+        
+        assert parse_user_query("phone")["success"] is True
+        assert mock_model.return_value.generate_content_async.call_count == 2
+        assert mock_model.call_args.args == ("gemini-2.0-flash-lite",)
+
+    @patch('utils.ai_helper.time.monotonic', return_value=1000.0)
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_failing_primary_model_is_skipped_until_probe(self, mock_model, mock_monotonic):
+        """Test that the circuit breaker skips the primary model after repeated failures"""
+        primary = AsyncMock(side_effect=InvalidArgument("bad"))
+        fallback = AsyncMock(return_value=_StreamedResponse(text='{"product_type": "laptop"}'))
+        mock_model.side_effect = lambda name: SimpleNamespace(
+            generate_content_async=primary if name == "gemini-2.0-flash" else fallback
+        )
+        
+        for i in range(BREAKER_FAILURE_THRESHOLD + 2):
+            assert parse_user_query(f"query {i}")["success"] is True
+        
+        # Once open, queries go straight to the fallback model
+        assert primary.call_count == BREAKER_FAILURE_THRESHOLD
+        assert fallback.call_count == BREAKER_FAILURE_THRESHOLD + 2
+        
+        # After the reset period one probe reaches the primary model again
+        mock_monotonic.return_value += BREAKER_RESET_SECONDS
+        primary.side_effect = None
+        primary.return_value = _StreamedResponse(text='{"product_type": "phone"}')
+        assert parse_user_query("probe")["product_type"] == "phone"
+        assert parse_user_query("closed again")["product_type"] == "phone"
+        assert primary.call_count == BREAKER_FAILURE_THRESHOLD + 2
+
+    @patch('utils.ai_helper.time.monotonic', return_value=1000.0)
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_cancelled_probe_is_released(self, mock_model, mock_monotonic):
+        """Test that a probe cancelled mid-call doesn't leave the breaker stuck open"""
+        mock_model.return_value.generate_content_async = AsyncMock(side_effect=asyncio.CancelledError)
+        breaker = _BREAKERS["gemini-2.0-flash"]
+        breaker.opened_at = mock_monotonic.return_value - BREAKER_RESET_SECONDS
+        
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(_call_model("gemini-2.0-flash", "probe"))
+        assert breaker.probing is False
+        
+        # The next call gets to probe, and closes the breaker
+        mock_model.return_value.generate_content_async = AsyncMock(return_value=_StreamedResponse(text="{}"))
+        asyncio.run(_call_model("gemini-2.0-flash", "probe"))
+        assert breaker.opened_at is None
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_parse_user_query_does_not_cache_fallback(self, mock_model):
+        """Test that a failed API call is retried rather than served from the cache"""
+        mock_instance = mock_model.return_value
+        mock_instance.generate_content_async = AsyncMock(side_effect=ServiceUnavailable("API unavailable"))
+        
+        result = parse_user_query("gaming laptop")
+        assert result["success"] is False
+        calls_after_first = mock_instance.generate_content_async.call_count
+        
+        parse_user_query("gaming laptop")
+        assert mock_instance.generate_content_async.call_count == 2 * calls_after_first
+
     @patch('utils.ai_helper.genai.GenerativeModel')
     @patch('utils.ai_helper._create_fallback_query_structure')
     def test_parse_user_query_api_failure(self, mock_fallback, mock_model):
         """Test handling of API failures"""
         # Set up the mock to raise an exception
         mock_instance = mock_model.return_value
-        mock_instance.generate_content.side_effect = ResourceExhausted("API quota exceeded")
+        mock_instance.generate_content_async = AsyncMock(side_effect=ResourceExhausted("API quota exceeded"))
         
         # Set up the fallback mock to return a simple structure
         fallback_response = {
@@ -96,6 +383,11 @@ class TestAIHelper:
         assert result["product"] == "laptop"
         assert result["price"] == 1000
         
+        # Test that braces in strings and in trailing text don't end the object early or late
+        text_with_braces = 'Result: {"product": "laptop {15\\" \\"pro\\"}", "specs": {"ram": "16GB"}} (see {notes})'
+        result = _extract_json_from_text(text_with_braces)
+        assert result == {"product": 'laptop {15" "pro"}', "specs": {"ram": "16GB"}}
+        
         # Test with malformed JSON
         malformed_json = '{"product": "laptop", "price": }'
         result = _extract_json_from_text(malformed_json)
@@ -106,6 +398,12 @@ class TestAIHelper:
         result = _extract_json_from_text(no_json)
         assert result == {}
 
+    def test_extract_json_from_text_without_orjson(self):
+        """Test that JSON extraction falls back to the standard library"""
+        with patch('utils.ai_helper.orjson', None):
+            assert _extract_json_from_text('Result: {"product": "laptop"}') == {"product": "laptop"}
+            assert _extract_json_from_text('{"product": }') == {}
+
     def test_ensure_complete_structure(self):
         """Test ensuring complete structure of parsed data"""
         # Test with incomplete data
@@ -131,6 +429,27 @@ class TestAIHelper:
         assert result["attributes"]["ram"] == "16GB"
         assert result["price_range"]["max"] == 1500  # Should keep original
         assert result["query_text"] == "Original query"  # Should keep original
+        
+        # Test with null values and a partial price range
+        partial_data = {"product_type": None, "brands": None, "price_range": {"min": 200}}
+        result = _ensure_complete_structure(partial_data, "Budget laptop", 800)
+        
+        # Verify nulls were replaced and the missing bound was filled in
+        assert result["product_type"] == ""
+        assert result["brands"] == []
+        assert result["price_range"] == {"min": 200, "max": 800}
+        
+        # Keywords built from the query are lowercased and deduplicated, in query order
+        result = _ensure_complete_structure({"product_type": "Gaming Laptop"}, "Gaming laptop for gaming", 800)
+        assert result["keywords"] == ["gaming", "laptop", "gaming laptop"]
+        
+        # Default containers are never shared between results
+        first = _ensure_complete_structure({}, "laptop", None)
+        second = _ensure_complete_structure({}, "laptop", None)
+        first["features"]["ram"] = "16GB"
+        first["brands"].append("Dell")
+        assert second["features"] == {} and second["brands"] == []
+        assert second["budget"] == 0 and second["price_range"] == {"min": 0, "max": 0}
 
     def test_create_fallback_query_structure(self):
         """Test creating fallback query structure"""
@@ -149,22 +468,27 @@ class TestAIHelper:
         assert "RTX 3080" in result["query_text"]
         assert result["price_range"]["max"] == 2000
 
+    def test_create_fallback_query_structure_matches_whole_terms(self):
+        """Test that a longer term isn't misread as a shorter one inside it"""
+        result = _create_fallback_query_structure("wireless headphones", None)
+        
+        assert result["product_category"] == "audio"
+        assert result["product_type"] == "headphone"
+
     @patch('utils.ai_helper.genai.GenerativeModel')
     def test_rank_recommendations(self, mock_model):
         """Test ranking recommendations"""
         # Mock the model response
         mock_instance = mock_model.return_value
-        mock_response = MagicMock()
-        mock_response.text = json.dumps([
-            {"id": 0, "score": 95, "reason": "Matches RAM requirement, Good price"},
-            {"id": 1, "score": 80, "reason": "Lower specs, Good price"}
-        ])
-        mock_instance.generate_content.return_value = mock_response
+        mock_response = _StreamedResponse(text=_RANK_RESULT_TEXT)
+        mock_instance.generate_content_async = AsyncMock(return_value=mock_response)
         
         # Test data
         products = [
             {"id": "123", "title": "Laptop A", "price": 999, "specs": ["16GB RAM", "512GB SSD"]},
-            {"id": "456", "title": "Laptop B", "price": 799, "specs": ["8GB RAM", "256GB SSD"]}
+            {"id": "456", "title": "Laptop B", "price": 799, "specs": ["8GB RAM", "256GB SSD"]},
+            {"id": "789", "title": "Laptop C", "price": 1199, "specs": ["32GB RAM", "1TB SSD"]},
+            {"id": "012", "title": "Laptop D", "price": 1099, "specs": ["16GB RAM", "1TB SSD"]}
         ]
         user_preferences = {"product_type": "laptop", "attributes": {"ram": "16GB"}, "price_range": {"max": 1000}}
         
@@ -172,29 +496,173 @@ class TestAIHelper:
         result = rank_recommendations(products, user_preferences)
         
         # Verify the model was called with the right arguments
-        call_args = mock_instance.generate_content.call_args[0][0]
+        call_args = mock_instance.generate_content_async.call_args[0][0]
         assert "rank" in call_args.lower()
         assert "laptop a" in call_args.lower()
         assert "laptop b" in call_args.lower()
+        assert "id|title|price|condition\n0|Laptop A|999|unknown\n" in call_args
         
-        # Verify result structure
-        assert len(result) == 2
+        # Verify result structure; products the model didn't rank follow, cheapest first
+        assert len(result) == 4
         assert result[0]["id"] == "123"
         assert "rank_score" in result[0]
         assert "rank_reason" in result[0]
         assert result[1]["id"] == "456"
+        assert [p["id"] for p in result[2:]] == ["012", "789"]
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_requests_json_mode(self, mock_model):
+        """Test that both ranking models are asked for schema-shaped JSON when the SDK supports it"""
+        mock_model.return_value.generate_content_async = AsyncMock(side_effect=[
+            ServiceUnavailable("API unavailable"),
+            ServiceUnavailable("API unavailable"),
+            ServiceUnavailable("API unavailable"),
+            _StreamedResponse(text=json.dumps(_RANK_RESULT)),
+        ])
+        products = [{"title": f"Laptop {i}", "price": 500 + i} for i in range(4)]
+        
+        result = rank_recommendations(products, {"product_type": "laptop"})
+        
+        assert result[0]["rank_score"] == 95
+        configs = [c.kwargs["generation_config"] for c in mock_model.return_value.generate_content_async.call_args_list]
+        assert len(configs) == 4
+        if "response_mime_type" in genai.types.GenerationConfig.__dataclass_fields__:
+            assert all(config["response_mime_type"] == "application/json" for config in configs)
+            assert configs[-1]["response_schema"] == _RANK_RESPONSE_SCHEMA
+        assert configs[-1] is configs[0]
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_runs_on_sdk_loop(self, mock_model):
+        """Test that sync rankings all run on the one long-lived SDK event loop"""
+        loops = []
+        
+        async def generate(*args, **kwargs):
+            loops.append(asyncio.get_running_loop())
+            return _StreamedResponse(text=_RANK_RESULT_TEXT)
+        
+        mock_model.return_value.generate_content_async = generate
+        products = [{"title": f"Laptop {i}", "price": 500 + i} for i in range(4)]
+        
+        for _ in range(2):
+            assert rank_recommendations(products, {"product_type": "laptop"})[0]["rank_score"] == 95
+        
+        assert loops == [_sdk_loop()] * 2
+        assert not _sdk_loop().is_closed()
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_async(self, mock_model):
+        """Test ranking from inside a running event loop"""
+        mock_model.return_value.generate_content_async = AsyncMock(return_value=_StreamedResponse(text=_RANK_RESULT_TEXT))
+        products = [
+            {"id": "123", "title": "Laptop A", "price": 999},
+            {"id": "456", "title": "Laptop B", "price": 799},
+            {"id": "789", "title": "Laptop C", "price": 599},
+            {"id": "012", "title": "Laptop D", "price": 699}
+        ]
+        
+        result = asyncio.run(rank_recommendations_async(products, {"product_type": "laptop"}))
+        
+        assert [p["id"] for p in result] == ["123", "456", "789", "012"]
+        assert result[0]["rank_score"] == 95
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_batch(self, mock_model):
+        """Test that separate product lists are ranked concurrently, up to the concurrency limit"""
+        in_flight = [0]
+        peak = [0]
+        
+        async def rank(prompt, **kwargs):
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            # Long enough for the next job to reach the SDK loop thread
+            await asyncio.sleep(0.01)
+            in_flight[0] -= 1
+            ids = _prompt_ids(prompt)
+            return _StreamedResponse(text=json.dumps([{"id": i, "score": i, "reason": "test"} for i in ids]))
+        
+        mock_model.return_value.generate_content_async = AsyncMock(side_effect=rank)
+        jobs = [
+            ([{"title": f"Laptop {job}-{i}", "price": 500 + i} for i in range(4)], {"product_type": "laptop"})
+            for job in range(5)
+        ]
+        jobs.append((
+            [{"title": "Laptop X", "price": 2000}, {"title": "Laptop Y", "price": 900}, {"title": "Laptop Z", "price": 800}, {"title": "Laptop W", "price": 700}],
+            {"keywords": ["laptop"]},
+            1000
+        ))
+        
+        results = asyncio.run(rank_recommendations_batch(jobs, concurrency=2))
+        
+        assert mock_model.return_value.generate_content_async.call_count == len(jobs)
+        assert peak[0] == 2
+        # Results come back in job order, each ranked on its own
+        assert [[p["title"] for p in result] for result in results[:5]] == [
+            [f"Laptop {job}-{i}" for i in reversed(range(4))] for job in range(5)
+        ]
+        # The budget is passed through, so the over-budget product is left out
+        assert [p["title"] for p in results[5]] == ["Laptop W", "Laptop Z", "Laptop Y", "Laptop X"]
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_skips_obvious_mismatches(self, mock_model):
+        """Test that over-budget and off-keyword products aren't sent to the model"""
+        mock_model.return_value.generate_content_async = AsyncMock(
+            return_value=_StreamedResponse(text=json.dumps([{"id": 0, "score": 90, "reason": "match"}]))
+        )
+        products = [
+            {"title": "Gaming Laptop", "price": 900},
+            {"title": "Gaming Laptop Pro", "price": 1500},  # over budget * RANKING_BUDGET_SLACK
+            {"title": "Office Chair", "price": 100},  # no keyword in the title
+            {"title": "Laptop Stand", "price": 50},
+        ]
+        
+        result = rank_recommendations(products, {"keywords": ["laptop"], "budget": 1000})
+        
+        prompt = mock_model.return_value.generate_content_async.call_args[0][0]
+        assert _prompt_ids(prompt) == [0, 3]
+        # Left-out products follow the ranked and unranked candidates, cheapest first
+        assert [p["title"] for p in result] == ["Gaming Laptop", "Laptop Stand", "Office Chair", "Gaming Laptop Pro"]
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_ranks_short_lists_locally(self, mock_model):
+        """Test that short lists are ranked by keywords, budget, condition and price without the model"""
+        mock_model.return_value.generate_content_async = AsyncMock()
+        products = [
+            {"title": "Office Chair", "price": 50},
+            {"title": "Gaming Laptop", "price": 1500, "condition": "new"},
+            {"title": "Gaming Laptop", "price": 900, "condition": "used"},
+        ]
+        
+        result = rank_recommendations(products, {"keywords": ["gaming", "laptop"], "condition": "new"}, budget=1000)
+        
+        mock_model.return_value.generate_content_async.assert_not_called()
+        assert [p["price"] for p in result] == [900, 1500, 50]
+        assert not any("rank_score" in p for p in result)
+    
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_ranks_fallback_parse_locally(self, mock_model):
+        """Test that preferences from a failed parse don't trigger a model call"""
+        mock_model.return_value.generate_content_async = AsyncMock()
+        products = [{"title": f"Laptop {i}", "price": 900 - i} for i in range(5)]
+        preferences = _create_fallback_query_structure("cheap laptop", None)
+        
+        result = rank_recommendations(products, preferences)
+        
+        mock_model.return_value.generate_content_async.assert_not_called()
+        assert [p["price"] for p in result] == [896, 897, 898, 899, 900]
 
     @patch('utils.ai_helper.genai.GenerativeModel')
     def test_rank_recommendations_api_failure(self, mock_model):
         """Test ranking recommendations with API failure"""
         # Setup mock to raise exception
         mock_instance = mock_model.return_value
-        mock_instance.generate_content.side_effect = ServiceUnavailable("API unavailable")
+        mock_instance.generate_content_async = AsyncMock(side_effect=ServiceUnavailable("API unavailable"))
         
         # Test data
         products = [
             {"id": "123", "title": "Laptop A", "price": 999},
-            {"id": "456", "title": "Laptop B", "price": 799}
+            {"id": "456", "title": "Laptop B", "price": 799},
+            {"id": "789", "title": "Laptop C", "price": 599},
+            {"id": "012", "title": "Laptop D", "price": 699}
         ]
         user_preferences = {"product_type": "laptop", "attributes": {"ram": "16GB"}}
         
@@ -202,4 +670,48 @@ class TestAIHelper:
         result = rank_recommendations(products, user_preferences)
         
         # Verify we get some kind of result even with API failure
-        assert len(result) > 0 
\ No newline at end of file
+        assert len(result) > 0
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_batches_large_lists(self, mock_model):
+        """Test that large product lists are ranked in concurrent batches and merged by score"""
+        products = [{"title": f"Laptop {i}", "price": 500 + i} for i in range(RANKING_BATCH_SIZE + 5)]
+        
+        async def rank_batch(prompt, **kwargs):
+            # Score every product in the prompt by its id so the merge order is predictable
+            ids = _prompt_ids(prompt)
+            return _StreamedResponse(text=json.dumps([{"id": i, "score": i, "reason": "test"} for i in ids]))
+        
+        mock_model.return_value.generate_content_async = AsyncMock(side_effect=rank_batch)
+        
+        result = rank_recommendations(list(products), {"product_type": "laptop"})
+        
+        # One model call per batch, and every product comes back once, best score first
+        assert mock_model.return_value.generate_content_async.call_count == 2
+        assert [p["title"] for p in result] == [f"Laptop {i}" for i in reversed(range(len(products)))]
+        
+        # Batches differ only after the shared instructions and preferences
+        prompts = [c.args[0] for c in mock_model.return_value.generate_content_async.call_args_list]
+        prefixes = {prompt.split("id|title|price|condition", 1)[0] for prompt in prompts}
+        assert len(prefixes) == 1
+
+    @patch('utils.ai_helper.genai.GenerativeModel')
+    def test_rank_recommendations_failed_batch_falls_back_to_price(self, mock_model):
+        """Test that a batch the models can't rank is appended after ranked products by price"""
+        products = [{"title": f"Laptop {i}", "price": 1000 - i} for i in range(RANKING_BATCH_SIZE + 2)]
+        
+        async def rank_first_batch_only(prompt, **kwargs):
+            ids = _prompt_ids(prompt)
+            if 0 not in ids:
+                raise ServiceUnavailable("API unavailable")
+            # Text-only response, as returned by the real SDK
+            return _StreamedResponse(text=json.dumps([{"id": i, "score": 50, "reason": "test"} for i in ids]))
+        
+        mock_model.return_value.generate_content_async = AsyncMock(side_effect=rank_first_batch_only)
+        
+        result = rank_recommendations(list(products), {"product_type": "laptop"})
+        
+        assert len(result) == len(products)
+        assert all("rank_score" in p for p in result[:RANKING_BATCH_SIZE])
+        # The unranked tail is ordered cheapest first
+        assert [p["price"] for p in result[RANKING_BATCH_SIZE:]] == [1000 - (RANKING_BATCH_SIZE + 1), 1000 - RANKING_BATCH_SIZE] 
\ No newline at end of file
@@ -1,154 +1,208 @@
 import pytest
-from unittest.mock import patch, MagicMock
-import sys
-import os
+from unittest.mock import MagicMock, patch
 import json
-
-# Add the parent directory to the path to import modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from types import SimpleNamespace
 
 from utils.location import (
     get_user_location,
     get_location_by_address,
     get_zipcode_from_coords,
-    calculate_distance
+    calculate_distance,
+    calculate_distance_batch,
+    USER_LOCATION_TTL,
+    _get_geocoder
 )
 
-class TestLocation:
-    @pytest.fixture
-    def mock_ip_response(self):
-        """Mock response from IP geolocation service"""
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
-            "ip": "8.8.8.8",
+# Body served for the IP geolocation lookup
+_IP_RESPONSE = {
+    "ip": "8.8.8.8",
+    "city": "Mountain View",
+    "region": "California",
+    "country": "US",
+    "loc": "37.3860,-122.0838",
+    "postal": "94035"
+}
+
+# Geocoded result for _ADDRESS, shaped like a geopy Location
+_ADDRESS = "1600 Amphitheatre Parkway, Mountain View, CA"
+_GEOCODED_ADDRESS = SimpleNamespace(
+    address="1600 Amphitheatre Parkway, Mountain View, CA 94043, USA",
+    latitude=37.4224,
+    longitude=-122.0841,
+    raw={
+        "address": {
             "city": "Mountain View",
-            "region": "California",
-            "country": "US",
-            "loc": "37.3860,-122.0838",
-            "postal": "94035"
+            "state": "California",
+            "postcode": "94043",
+            "country": "United States"
         }
-        return mock_response
+    }
+)
+
+class TestLocation:
+    @pytest.fixture(scope="module", autouse=True)
+    def mock_nominatim_class(self):
+        """Replace Nominatim once for the module so no test reaches the real geocoder"""
+        with pytest.MonkeyPatch.context() as mp:
+            # Every Nominatim(...) call hands back the same geocoder mock
+            mock_class = MagicMock()
+            mock_class.return_value = MagicMock()
+            mp.setattr("geopy.geocoders.Nominatim", mock_class)
+            _get_geocoder.cache_clear()
+            yield mock_class
+        _get_geocoder.cache_clear()
     
-    @pytest.fixture
-    def mock_geocoder(self):
-        """Mock Nominatim geocoder"""
-        mock_nominatim = MagicMock()
-        mock_location = MagicMock()
-        mock_location.address = "1600 Amphitheatre Parkway, Mountain View, CA 94043, USA"
-        mock_location.latitude = 37.4224
-        mock_location.longitude = -122.0841
-        mock_location.raw = {
-            "address": {
-                "city": "Mountain View",
-                "state": "California",
-                "postcode": "94043",
-                "country": "United States"
-            }
-        }
-        mock_nominatim.geocode.return_value = mock_location
-        return mock_nominatim
+    @pytest.fixture(autouse=True)
+    def reset_nominatim(self, mock_nominatim_class):
+        """Clear what the previous test configured on the shared geocoder, and cached results"""
+        yield
+        mock_nominatim_class.reset_mock()
+        mock_nominatim_class.return_value.reset_mock(return_value=True, side_effect=True)
+        get_user_location.cache_clear()
+        get_location_by_address.cache_clear()
+        get_zipcode_from_coords.cache_clear()
     
-    @patch('utils.location.requests.get')
-    def test_get_user_location(self, mock_get, mock_ip_response):
-        """Test getting user location from IP"""
+    @pytest.mark.parametrize("response, expected", [
+        pytest.param({"json": _IP_RESPONSE}, {
+            "city": "Mountain View",
+            "region": "California",
+            "country": "US",
+            "zipcode": "94035",
+            "latitude": 37.3860,
+            "longitude": -122.0838
+        }, id="found"),
+        pytest.param({"body": Exception("API error")}, None, id="error"),
+    ])
+    def test_get_user_location(self, mock_http, response, expected):
+        """Test getting user location from IP, and None when the lookup fails"""
         # Set up the mock
-        mock_get.return_value = mock_ip_response
+        mock_http.get('https://ipinfo.io/json', **response)
         
         # Call the function
         location = get_user_location()
         
         # Verify the result
-        assert location['city'] == "Mountain View"
-        assert location['region'] == "California"
-        assert location['country'] == "US"
-        assert location['zipcode'] == "94035"
-        assert location['latitude'] == 37.3860
-        assert location['longitude'] == -122.0838
+        if expected is None:
+            assert location is None
+        else:
+            assert {key: location[key] for key in expected} == expected
         
         # Verify the request was made correctly
-        mock_get.assert_called_once_with('https://ipinfo.io/json')
+        assert len(mock_http.calls) == 1
+        assert mock_http.calls[0].request.url == 'https://ipinfo.io/json'
     
-    @patch('utils.location.requests.get')
-    def test_get_user_location_error(self, mock_get):
-        """Test error handling in get_user_location"""
-        # Set up the mock to raise an exception
-        mock_get.side_effect = Exception("API error")
-        
-        # Call the function
-        location = get_user_location()
-        
-        # Verify None is returned on error
-        assert location is None
+    def test_get_user_location_is_cached(self, mock_http):
+        """Test that the IP lookup is reused until it expires, and failures are retried"""
+        mock_http.get('https://ipinfo.io/json', body=Exception("API error"))
+        mock_http.get('https://ipinfo.io/json', json=_IP_RESPONSE)
+        
+        with patch('utils.location.time.monotonic', return_value=1000.0) as mock_monotonic:
+            assert get_user_location() is None
+            first = get_user_location()
+            first["city"] = "Changed"
+            assert get_user_location()["city"] == "Mountain View"
+            assert len(mock_http.calls) == 2
+            
+            mock_monotonic.return_value += USER_LOCATION_TTL
+            get_user_location()
+            assert len(mock_http.calls) == 3
     
-    @patch('utils.location.Nominatim')
-    def test_get_location_by_address(self, mock_nominatim_class, mock_geocoder):
+    @pytest.mark.parametrize("address, geocoded, expected", [
+        pytest.param(_ADDRESS, _GEOCODED_ADDRESS, {
+            "city": "Mountain View",
+            "region": "California",
+            "zipcode": "94043",
+            "country": "United States",
+            "latitude": 37.4224,
+            "longitude": -122.0841
+        }, id="found"),
+        pytest.param("Non-existent address", None, None, id="not-found"),
+    ])
+    def test_get_location_by_address(self, mock_nominatim_class, address, geocoded, expected):
         """Test getting location details from an address"""
         # Set up the mock
-        mock_nominatim_class.return_value = mock_geocoder
+        mock_geocoder = mock_nominatim_class.return_value
+        mock_geocoder.geocode.return_value = geocoded
         
         # Call the function
-        address = "1600 Amphitheatre Parkway, Mountain View, CA"
         location = get_location_by_address(address)
         
-        # Verify the result
-        assert location['city'] == "Mountain View"
-        assert location['region'] == "California"
-        assert location['zipcode'] == "94043"
-        assert location['country'] == "United States"
-        assert location['latitude'] == 37.4224
-        assert location['longitude'] == -122.0841
+        # Verify the result (None when the address is not found)
+        if expected is None:
+            assert location is None
+        else:
+            assert {key: location[key] for key in expected} == expected
         
         # Verify the geocoder was called correctly
         mock_geocoder.geocode.assert_called_once_with(address, addressdetails=True, language="en")
     
-    @patch('utils.location.Nominatim')
-    def test_get_location_by_address_not_found(self, mock_nominatim_class):
-        """Test handling when address is not found"""
-        # Set up the mock to return None (address not found)
-        mock_geocoder = MagicMock()
-        mock_geocoder.geocode.return_value = None
-        mock_nominatim_class.return_value = mock_geocoder
-        
-        # Verify None is returned when address is not found
-        location = get_location_by_address("Non-existent address")
-        assert location is None
+    def test_get_location_by_address_is_cached(self, mock_nominatim_class):
+        """Test that repeat lookups of an address reuse the first geocode result"""
+        mock_geocoder = mock_nominatim_class.return_value
+        mock_geocoder.geocode.return_value = _GEOCODED_ADDRESS
+        
+        first = get_location_by_address(_ADDRESS)
+        second = get_location_by_address("  " + _ADDRESS.replace(" ", "  ") + " ")
+        
+        # Extra whitespace maps to the same cache entry
+        assert second == first
+        assert mock_geocoder.geocode.call_count == 1
+        
+        # Callers get their own copy of the cached result
+        first["city"] = "Changed"
+        assert get_location_by_address(_ADDRESS)["city"] == "Mountain View"
     
-    @patch('utils.location.Nominatim')
-    def test_get_zipcode_from_coords(self, mock_nominatim_class):
-        """Test getting zipcode from coordinates"""
-        # Set up the mock
-        mock_geocoder = MagicMock()
-        mock_location = MagicMock()
-        mock_location.raw = {
-            "address": {
-                "postcode": "94043"
-            }
-        }
-        mock_geocoder.reverse.return_value = mock_location
-        mock_nominatim_class.return_value = mock_geocoder
+    def test_get_location_by_address_errors_are_not_cached(self, mock_nominatim_class):
+        """Test that a failed lookup is retried on the next call"""
+        mock_geocoder = mock_nominatim_class.return_value
+        mock_geocoder.geocode.side_effect = [Exception("API error"), _GEOCODED_ADDRESS]
+        
+        assert get_location_by_address(_ADDRESS) is None
+        assert get_location_by_address(_ADDRESS)["city"] == "Mountain View"
+        assert mock_geocoder.geocode.call_count == 2
+    
+    @pytest.mark.parametrize("reverse_result, expected", [
+        pytest.param(SimpleNamespace(raw={"address": {"postcode": "94043"}}), "94043", id="found"),
+        pytest.param(Exception("API error"), None, id="error"),
+    ])
+    def test_get_zipcode_from_coords(self, mock_nominatim_class, reverse_result, expected):
+        """Test getting zipcode from coordinates, and None on geocoder errors"""
+        # Set up the mock; an exception in the side_effect list is raised instead of returned
+        mock_geocoder = mock_nominatim_class.return_value
+        mock_geocoder.reverse.side_effect = [reverse_result]
         
         # Call the function
         zipcode = get_zipcode_from_coords(37.4224, -122.0841)
         
         # Verify the result
-        assert zipcode == "94043"
+        assert zipcode == expected
         
         # Verify the geocoder was called correctly
         mock_geocoder.reverse.assert_called_once_with((37.4224, -122.0841))
     
-    @patch('utils.location.Nominatim')
-    def test_get_zipcode_from_coords_error(self, mock_nominatim_class):
-        """Test error handling in get_zipcode_from_coords"""
-        # Set up the mock to raise an exception
-        mock_geocoder = MagicMock()
-        mock_geocoder.reverse.side_effect = Exception("API error")
-        mock_nominatim_class.return_value = mock_geocoder
+    def test_get_zipcode_from_coords_rounds_cache_key(self, mock_nominatim_class):
+        """Test that coordinates within the same 4-decimal cell share one reverse geocode"""
+        mock_geocoder = mock_nominatim_class.return_value
+        mock_geocoder.reverse.return_value = SimpleNamespace(raw={"address": {"postcode": "94043"}})
         
-        # Call the function
-        zipcode = get_zipcode_from_coords(37.4224, -122.0841)
+        assert get_zipcode_from_coords(37.42241, -122.08411) == "94043"
+        assert get_zipcode_from_coords(37.42238, -122.08405) == "94043"
         
-        # Verify None is returned on error
-        assert zipcode is None
+        # Both points round to the same cell, which is what gets looked up
+        mock_geocoder.reverse.assert_called_once_with((37.4224, -122.0841))
+    
+    def test_geocoder_is_shared(self, mock_nominatim_class):
+        """Test that forward and reverse lookups reuse one Nominatim instance"""
+        _get_geocoder.cache_clear()
+        mock_geocoder = mock_nominatim_class.return_value
+        mock_geocoder.geocode.return_value = _GEOCODED_ADDRESS
+        mock_geocoder.reverse.return_value = SimpleNamespace(raw={"address": {"postcode": "94043"}})
+        
+        get_location_by_address(_ADDRESS)
+        get_location_by_address("Mountain View, CA")
+        get_zipcode_from_coords(37.4224, -122.0841)
+        
+        mock_nominatim_class.assert_called_once_with(user_agent="tech_deals_finder", timeout=5)
     
     def test_calculate_distance(self):
         """Test distance calculation between two points"""
@@ -160,4 +214,23 @@ class TestLocation:
         
         # Distance should be around 350 miles
         assert isinstance(distance, (int, float))
-        assert distance > 0 
\ No newline at end of file
+        assert distance == pytest.approx(347.4, abs=1)
+    
+    def test_calculate_distance_batch(self):
+        """Test batched distance calculation matches the scalar path"""
+        origin = (37.7749, -122.4194)  # San Francisco
+        destinations = [
+            (34.0522, -118.2437),  # Los Angeles
+            (47.6062, -122.3321),  # Seattle
+            (37.7749, -122.4194)   # San Francisco
+        ]
+        
+        distances = calculate_distance_batch(origin, destinations)
+        
+        assert distances.shape == (3,)
+        assert distances == pytest.approx([calculate_distance(origin, d) for d in destinations])
+        assert distances[2] == 0
+        
+        # Pairwise origins give the same result as one broadcast origin
+        pairwise = calculate_distance_batch([origin] * 3, destinations)
+        assert pairwise == pytest.approx(distances) 
\ No newline at end of file
@@ -3,103 +3,122 @@ Tests for the logging_setup module
 """
 
 import os
+import copy
 import sys
 import pytest
 import logging
-import tempfile
-import shutil
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock, mock_open
 from loguru import logger
 
 from utils.logging_setup import setup_logging, SCREENSHOT_PATH, HTML_PATH
 
+# Standard logging record for the InterceptHandler tests, built once via
+# makeLogRecord; tests copy it before emitting
+_BASE_RECORD = logging.makeLogRecord({
+    "name": "test_logger",
+    "levelno": logging.ERROR,
+    "levelname": logging.getLevelName(logging.ERROR),
+    "pathname": __file__,
+    "lineno": 42,
+    "msg": "Test log message",
+})
+
+
+@pytest.fixture(scope="module")
+def temp_dir(tmp_path_factory):
+    """Temporary directory with a logs folder, shared by the module
+    
+    Module-scoped so it is created before the autouse log_io fixture stubs
+    out Path.mkdir; pytest removes it along with its other temp dirs.
+    """
+    temp_dir = tmp_path_factory.mktemp("logging")
+    (temp_dir / "logs").mkdir()
+    return temp_dir
+
 
 class TestLoggingSetup:
     
+    @pytest.fixture(autouse=True)
+    def log_io(self, monkeypatch):
+        """Replace sink registration and directory creation for every test"""
+        log_io = SimpleNamespace(add=MagicMock(), mkdir=MagicMock())
+        monkeypatch.setattr("loguru.logger.add", log_io.add)
+        monkeypatch.setattr("pathlib.Path.mkdir", log_io.mkdir)
+        return log_io
+    
     @pytest.fixture
-    def setup_temp_dir(self):
+    def setup_temp_dir(self, temp_dir):
         """Set up temporary directory for logs"""
-        # Create temp directory
-        temp_dir = tempfile.mkdtemp()
-        log_dir = Path(temp_dir) / "logs"
-        log_dir.mkdir(exist_ok=True)
-        
-        # Save original path
-        original_dir = os.getcwd()
-        
         # Patch Path to use the temp directory
-        with patch('utils.logging_setup.Path', autospec=True) as mock_path:
+        with patch('utils.logging_setup.Path') as mock_path:
             mock_path.return_value.mkdir.return_value = None
-            mock_path.return_value.__truediv__.return_value = log_dir
+            mock_path.return_value.__truediv__.return_value = temp_dir / "logs"
             yield temp_dir
-            
-        # Clean up
-        os.chdir(original_dir)
-        shutil.rmtree(temp_dir)
     
-    def test_setup_logging_creates_directories(self):
+    def test_setup_logging_creates_directories(self, log_io):
         """Test that setup_logging creates necessary directories"""
-        with patch('pathlib.Path.mkdir') as mock_mkdir:
-            setup_logging()
-            
-            # Verify directories were created
-            assert mock_mkdir.call_count >= 2  # Should create at least logs and screenshots dirs
+        setup_logging()
+        
+        # Verify directories were created
+        assert log_io.mkdir.call_count >= 2  # Should create at least logs and screenshots dirs
     
-    def test_setup_logging_configures_logger(self):
+    def test_setup_logging_configures_logger(self, log_io):
         """Test that setup_logging configures the logger correctly"""
-        with patch('loguru.logger.add') as mock_add:
-            with patch('pathlib.Path.mkdir'):
-                setup_logging()
-                
-                # Verify logger.add was called at least 3 times (stderr, main log, error log)
-                assert mock_add.call_count >= 3
-                
-                # Verify the calls to logger.add include expected parameters
-                for call_args in mock_add.call_args_list:
-                    args, kwargs = call_args
-                    
-                    # Check console handler
-                    if len(args) > 0 and args[0] == sys.stderr:
-                        assert 'level' in kwargs
-                        assert 'colorize' in kwargs
-                        assert kwargs['colorize'] is True
-                    
-                    # Check file handlers
-                    if len(args) > 0 and isinstance(args[0], str):
-                        if 'errors.log' in args[0]:
-                            assert kwargs.get('level') == 'WARNING'
-                            assert 'filter' in kwargs
-                        else:
-                            assert 'level' in kwargs
-                            assert 'rotation' in kwargs
-                            assert 'compression' in kwargs
+        setup_logging()
+        
+        # Verify logger.add was called at least 3 times (stderr, main log, error log)
+        assert log_io.add.call_count >= 3
+        
+        # Verify the calls to logger.add include expected parameters
+        for call_args in log_io.add.call_args_list:
+            args, kwargs = call_args
+            
+            # Check console handler
+            if len(args) > 0 and args[0] == sys.stderr:
+                assert 'level' in kwargs
+                assert 'colorize' in kwargs
+                assert kwargs['colorize'] is True
+            
+            # Check file handlers
+            if len(args) > 0 and isinstance(args[0], str):
+                if 'errors.log' in args[0]:
+                    assert kwargs.get('level') == 'WARNING'
+                    assert 'filter' in kwargs
+                    assert kwargs.get('diagnose') is True
+                else:
+                    assert 'level' in kwargs
+                    assert 'rotation' in kwargs
+                    assert 'compression' in kwargs
+                    # Only the error log pays for variable dumps
+                    assert kwargs.get('diagnose') is False
+                    assert kwargs.get('backtrace') is False
     
     def test_setup_logging_registers_exception_handler(self):
         """Test that setup_logging registers an exception handler"""
         original_excepthook = sys.excepthook
         
         try:
-            with patch('pathlib.Path.mkdir'):
-                setup_logging()
-                
-                # Verify excepthook was changed
-                assert sys.excepthook != original_excepthook
-                
-                # Test the exception handler with a test exception
-                try:
-                    with patch('loguru.logger.opt') as mock_logger_opt:
-                        mock_error = MagicMock()
-                        mock_logger_opt.return_value.error = mock_error
-                        
-                        # Trigger the exception handler with a test exception
-                        test_exception = ValueError("Test exception")
-                        sys.excepthook(ValueError, test_exception, None)
-                        
-                        # Verify logger.opt().error was called
-                        mock_error.assert_called_once()
-                except Exception as e:
-                    pytest.fail(f"Exception handler test failed: {e}")
+            setup_logging()
+            
+            # Verify excepthook was changed
+            assert sys.excepthook != original_excepthook
+            
+            # Test the exception handler with a test exception
+            try:
+                with patch('loguru.logger.opt') as mock_logger_opt:
+                    mock_error = MagicMock()
+                    mock_logger_opt.return_value.error = mock_error
+                    
+                    # Trigger the exception handler with a test exception
+                    test_exception = ValueError("Test exception")
+                    sys.excepthook(ValueError, test_exception, None)
+                    
+                    # Verify logger.opt().error was called
+                    mock_error.assert_called_once()
+            except Exception as e:
+                pytest.fail(f"Exception handler test failed: {e}")
         finally:
             # Restore original excepthook
             sys.excepthook = original_excepthook
@@ -113,14 +132,13 @@ class TestLoggingSetup:
         sys.__excepthook__ = mock_sys_excepthook
         
         try:
-            with patch('pathlib.Path.mkdir'):
-                setup_logging()
-                
-                # Trigger the exception handler with KeyboardInterrupt
-                sys.excepthook(KeyboardInterrupt, KeyboardInterrupt(), None)
-                
-                # Verify sys.__excepthook__ was called
-                mock_sys_excepthook.assert_called_once()
+            setup_logging()
+            
+            # Trigger the exception handler with KeyboardInterrupt
+            sys.excepthook(KeyboardInterrupt, KeyboardInterrupt(), None)
+            
+            # Verify sys.__excepthook__ was called
+            mock_sys_excepthook.assert_called_once()
         finally:
             # Restore original hooks
             sys.excepthook = original_excepthook
@@ -128,39 +146,50 @@ class TestLoggingSetup:
     
     def test_intercept_handler(self):
         """Test the InterceptHandler class"""
-        with patch('pathlib.Path.mkdir'):
-            with patch('loguru.logger.opt') as mock_logger_opt:
-                mock_log = MagicMock()
-                mock_logger_opt.return_value.log = mock_log
-                
-                setup_logging()
-                
-                # Create a standard logging record
-                record = logging.LogRecord(
-                    name="test_logger",
-                    level=logging.ERROR,
-                    pathname=__file__,
-                    lineno=42,
-                    msg="Test log message",
-                    args=(),
-                    exc_info=None
-                )
-                
-                # Get the InterceptHandler instance
-                intercept_handler = None
-                for handler in logging.getLogger().handlers:
-                    if handler.__class__.__name__ == 'InterceptHandler':
-                        intercept_handler = handler
-                        break
-                
-                assert intercept_handler is not None, "InterceptHandler not found"
-                
-                # Emit the record through the handler
-                intercept_handler.emit(record)
-                
-                # Verify logger.opt().log was called
-                mock_logger_opt.assert_called_once()
-                mock_log.assert_called_once()
+        with patch('loguru.logger.opt') as mock_logger_opt:
+            mock_log = MagicMock()
+            mock_logger_opt.return_value.log = mock_log
+            
+            setup_logging()
+            
+            # Copy the prebuilt standard logging record
+            record = copy.copy(_BASE_RECORD)
+            
+            # Get the InterceptHandler instance
+            intercept_handler = None
+            for handler in logging.getLogger().handlers:
+                if handler.__class__.__name__ == 'InterceptHandler':
+                    intercept_handler = handler
+                    break
+            
+            assert intercept_handler is not None, "InterceptHandler not found"
+            
+            # Emit the record through the handler
+            intercept_handler.emit(record)
+            
+            # Verify logger.opt().log was called
+            mock_logger_opt.assert_called_once()
+            mock_log.assert_called_once()
+    
+    def test_intercept_handler_caches_caller_depth(self):
+        """Test that the caller's stack depth is found once per call site and then reused"""
+        with patch('loguru.logger.opt') as mock_logger_opt:
+            setup_logging()
+            handler = next(h for h in logging.getLogger().handlers if h.__class__.__name__ == 'InterceptHandler')
+            std_logger = logging.getLogger("test_logger")
+            
+            for _ in range(3):
+                std_logger.warning("Repeated message")
+            
+            depths = [c.kwargs["depth"] for c in mock_logger_opt.call_args_list]
+            assert len(set(depths)) == 1
+            assert list(handler._depth_cache.values()) == depths[:1]
+            
+            # A cached call site uses the stored depth without walking the stack
+            record = copy.copy(_BASE_RECORD)
+            handler._depth_cache[(record.pathname, record.lineno)] = 7
+            handler.emit(record)
+            assert mock_logger_opt.call_args.kwargs["depth"] == 7
     
     def test_constants(self):
         """Test that the module-level constants are defined correctly"""
@@ -171,7 +200,7 @@ class TestLoggingSetup:
         assert "logs/screenshots" in SCREENSHOT_PATH
         assert "logs" in HTML_PATH
     
-    def test_setup_logging_with_custom_config(self):
+    def test_setup_logging_with_custom_config(self, log_io):
         """Test setup_logging with custom configuration"""
         # Mock the LOGGING config
         mock_config = {
@@ -182,23 +211,21 @@ class TestLoggingSetup:
         }
         
         with patch('utils.logging_setup.LOGGING', mock_config):
-            with patch('loguru.logger.add') as mock_add:
-                with patch('pathlib.Path.mkdir'):
-                    setup_logging()
-                    
-                    # Verify logger was configured with custom settings
-                    for call_args in mock_add.call_args_list:
-                        args, kwargs = call_args
-                        if 'level' in kwargs:
-                            # The console and main log should use DEBUG level
-                            if args[0] == sys.stderr or 'crawler.log' in args[0]:
-                                assert kwargs['level'] == 'DEBUG'
-                        
-                        if 'format' in kwargs:
-                            assert kwargs['format'] == "CUSTOM FORMAT {message}"
-                        
-                        if 'rotation' in kwargs:
-                            assert kwargs['rotation'] == 5242880
-                        
-                        if 'retention' in kwargs:
-                            assert kwargs['retention'] == 3 
\ No newline at end of file
+            setup_logging()
+            
+            # Verify logger was configured with custom settings
+            for call_args in log_io.add.call_args_list:
+                args, kwargs = call_args
+                if 'level' in kwargs:
+                    # The console and main log should use DEBUG level
+                    if args[0] == sys.stderr or 'crawler.log' in args[0]:
+                        assert kwargs['level'] == 'DEBUG'
+                
+                if 'format' in kwargs:
+                    assert kwargs['format'] == "CUSTOM FORMAT {message}"
+                
+                if 'rotation' in kwargs:
+                    assert kwargs['rotation'] == 5242880
+                
+                if 'retention' in kwargs:
+                    assert kwargs['retention'] == 3
\ No newline at end of file
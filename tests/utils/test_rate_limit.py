@@ -0,0 +1,56 @@
+import pytest
+import asyncio
+from unittest.mock import patch
+
+from utils.rate_limit import TokenBucket
+
+class TestTokenBucket:
+    """Test suite for the token-bucket rate limiter"""
+
+    def test_burst_up_to_capacity_without_waiting(self):
+        """Test that calls within the burst size don't wait"""
+        with patch('utils.rate_limit.time.monotonic', return_value=100.0), \
+             patch('utils.rate_limit.time.sleep') as mock_sleep:
+            bucket = TokenBucket(rpm=3)
+            for _ in range(3):
+                bucket.acquire()
+
+            mock_sleep.assert_not_called()
+
+    def test_waits_for_refill_when_empty(self):
+        """Test that an empty bucket makes callers wait for their token"""
+        with patch('utils.rate_limit.time.monotonic', return_value=100.0), \
+             patch('utils.rate_limit.time.sleep') as mock_sleep:
+            bucket = TokenBucket(rpm=60)
+            for _ in range(60):
+                bucket.acquire()
+            bucket.acquire()
+            bucket.acquire()
+
+            # One token per second; the second waiter queues behind the first
+            assert [c.args[0] for c in mock_sleep.call_args_list] == pytest.approx([1.0, 2.0])
+
+    def test_refills_over_time(self):
+        """Test that tokens come back as time passes, capped at capacity"""
+        clock = [100.0]
+        with patch('utils.rate_limit.time.monotonic', side_effect=lambda: clock[0]), \
+             patch('utils.rate_limit.time.sleep') as mock_sleep:
+            bucket = TokenBucket(rpm=60)
+            for _ in range(60):
+                bucket.acquire()
+            clock[0] += 3600
+            for _ in range(60):
+                bucket.acquire()
+
+            mock_sleep.assert_not_called()
+            assert bucket.tokens == 0
+
+    def test_acquire_async_sleeps_without_blocking(self):
+        """Test that the async variant waits with asyncio.sleep"""
+        with patch('utils.rate_limit.time.monotonic', return_value=100.0), \
+             patch('utils.rate_limit.asyncio.sleep') as mock_sleep:
+            bucket = TokenBucket(rpm=1)
+            asyncio.run(bucket.acquire_async())
+            asyncio.run(bucket.acquire_async())
+
+            mock_sleep.assert_called_once_with(pytest.approx(60.0))
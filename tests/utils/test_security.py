@@ -1,42 +1,93 @@
 import pytest
+import io
 import os
+import hmac
 import time
-from unittest.mock import patch, MagicMock, mock_open
-import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Mapping
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
 import base64
 import json
 
-# Add the parent directory to the path to import modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from utils.security import SecurityManager, _RFernetCipher
+from utils.config import SECURITY
+from cryptography.fernet import Fernet, InvalidToken
 
-from utils.security import SecurityManager
-from cryptography.fernet import Fernet
+# One key for the whole module, served in place of the key file
+_TEST_KEY = Fernet.generate_key()
 
+# Credentials payload for the encryption round-trip test, pre-serialized
+_TEST_DICT = {"username": "testuser", "password": "testpass"}
+_TEST_DICT_STR = json.dumps(_TEST_DICT)
+
+# Fixed monotonic clock reading for the rate-limit tests
+_NOW = 1_000_000.0
+
+def _open_test_key(*args, **kwargs):
+    """Stand-in for open() that serves _TEST_KEY as an in-memory key file"""
+    return io.BytesIO(_TEST_KEY)
+
+@pytest.mark.xdist_group("security")
 class TestSecurityManager:
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def security_manager(self):
         """Create a security manager instance for testing with mocked key file"""
-        with patch("builtins.open", mock_open(read_data=Fernet.generate_key())), \
-             patch("os.path.exists", return_value=True):
-            return SecurityManager()
+        with patch("builtins.open", _open_test_key):
+            manager = SecurityManager()
+            # Load the key and cipher while the key file is mocked
+            manager.cipher
+            return manager
+    
+    @pytest.fixture(autouse=True)
+    def reset_security_state(self, security_manager):
+        """Clear the shared manager's rate-limit and login state after each test"""
+        yield
+        security_manager.request_log.clear()
+        security_manager.login_attempts.clear()
     
-    def test_initialization(self):
+    def test_initialization(self, tmp_path, monkeypatch):
         """Test the initialization of SecurityManager"""
         # Test when key file doesn't exist
-        with patch("builtins.open", mock_open()), \
-             patch("os.path.exists", return_value=False):
+        monkeypatch.chdir(tmp_path)
+        with patch("utils.security.Fernet.generate_key", return_value=_TEST_KEY) as generate_key:
             security = SecurityManager()
-            # Verify a new key was generated
-            assert security.key is not None
-            assert len(security.key) > 0
+            # Verify a new key was generated and saved, with no temp file left behind
+            assert security.key == _TEST_KEY
+            generate_key.assert_called_once()
+        assert [p.name for p in tmp_path.iterdir()] == [".encryption_key"]
+        assert (tmp_path / ".encryption_key").read_bytes() == _TEST_KEY
         
         # Test when key file exists
-        test_key = Fernet.generate_key()
-        with patch("builtins.open", mock_open(read_data=test_key)), \
-             patch("os.path.exists", return_value=True):
+        with patch("builtins.open", _open_test_key):
             security = SecurityManager()
             # Verify the key was loaded
-            assert security.key == test_key
+            assert security.key == _TEST_KEY
+    
+    def test_key_file_creation_race(self, tmp_path, monkeypatch):
+        """Test that a process losing the race to create the key file uses the winner's key"""
+        monkeypatch.chdir(tmp_path)
+        winner_key = Fernet.generate_key()
+        real_link = os.link
+        
+        def link_after_other_process(src, dst):
+            (tmp_path / dst).write_bytes(winner_key)
+            real_link(src, dst)
+        
+        with patch("utils.security.os.link", side_effect=link_after_other_process):
+            assert SecurityManager().key == winner_key
+        assert [p.name for p in tmp_path.iterdir()] == [".encryption_key"]
+    
+    def test_key_is_loaded_lazily(self):
+        """Test that creating a manager doesn't touch the key file until the cipher is needed"""
+        with patch("builtins.open", side_effect=_open_test_key) as open_key:
+            security = SecurityManager()
+            open_key.assert_not_called()
+            
+            token = security.encrypt_data("lazy")
+            assert security.decrypt_data(token) == "lazy"
+            open_key.assert_called_once()
     
     def test_encrypt_decrypt_data(self, security_manager):
         """Test encryption and decryption of data"""
@@ -51,32 +102,225 @@ class TestSecurityManager:
         decrypted = security_manager.decrypt_data(encrypted)
         assert decrypted == test_data
         
-        # Test encrypting a dictionary (convert to string first)
-        test_dict = {"username": "testuser", "password": "testpass"}
-        dict_str = json.dumps(test_dict)
-        encrypted_dict = security_manager.encrypt_data(dict_str)
+        # Test encrypting a dictionary (serialized once at import)
+        encrypted_dict = security_manager.encrypt_data(_TEST_DICT_STR)
         decrypted_dict_str = security_manager.decrypt_data(encrypted_dict)
-        assert json.loads(decrypted_dict_str) == test_dict
+        assert decrypted_dict_str == _TEST_DICT_STR
+        assert json.loads(decrypted_dict_str) == _TEST_DICT
+    
+    def test_encrypt_decrypt_data_raw(self, security_manager):
+        """Test binary tokens: round trip, Fernet compatibility and tamper detection"""
+        token = security_manager.encrypt_data_raw("Sensitive data to encrypt")
+        
+        assert isinstance(token, bytes)
+        assert security_manager.decrypt_data_raw(token) == "Sensitive data to encrypt"
+        
+        # The token is a Fernet token without its base64 envelope
+        assert Fernet(_TEST_KEY).decrypt(base64.urlsafe_b64encode(token)) == b"Sensitive data to encrypt"
+        
+        tampered = bytearray(token)
+        tampered[30] ^= 1
+        with pytest.raises(InvalidToken):
+            security_manager.decrypt_data_raw(bytes(tampered))
+        with pytest.raises(InvalidToken):
+            security_manager.decrypt_data_raw(token[:40])
+    
+    def test_encrypt_decrypt_bulk(self, security_manager):
+        """Test AES-GCM bulk encryption round trip and rejection of tampered tokens"""
+        blob = bytes(range(256)) * 64
+        token = security_manager.encrypt_bulk(blob)
+        
+        assert security_manager.decrypt_bulk(token) == blob
+        assert security_manager.decrypt_bulk(security_manager.encrypt_bulk("text")) == b"text"
+        # Fresh nonce per call
+        assert security_manager.encrypt_bulk(blob) != token
+        
+        tampered = bytearray(token)
+        tampered[-1] ^= 1
+        with pytest.raises(InvalidToken):
+            security_manager.decrypt_bulk(bytes(tampered))
+        with pytest.raises(InvalidToken):
+            security_manager.decrypt_bulk(token[:8])
     
-    def test_rate_limit_check(self, security_manager):
+    def test_cipher_is_reused(self, security_manager):
+        """Test that encrypt/decrypt reuse the cipher built at initialization"""
+        assert isinstance(security_manager.cipher, (Fernet, _RFernetCipher))
+        
+        # No new Fernet instance should be created per call
+        with patch("utils.security.Fernet", wraps=Fernet) as fernet_class:
+            for _ in range(2):
+                security_manager.decrypt_data(security_manager.encrypt_data("round trip"))
+            assert fernet_class.call_count == 0
+    
+    def test_cipher_falls_back_without_rfernet(self):
+        """Test that cryptography's Fernet is used when rfernet isn't installed, with compatible tokens"""
+        with patch("builtins.open", _open_test_key), \
+             patch("utils.security.rfernet", None):
+            security = SecurityManager()
+            assert isinstance(security.cipher, Fernet)
+        
+        assert Fernet(_TEST_KEY).decrypt(security.encrypt_data("round trip")) == b"round trip"
+    
+    @pytest.fixture
+    def frozen_clock(self, monkeypatch):
+        """Pin the clock seen by utils.security to _NOW"""
+        monkeypatch.setattr("utils.security.time", SimpleNamespace(monotonic=lambda: _NOW))
+    
+    def test_rate_limit_check(self, security_manager, frozen_clock):
         """Test rate limiting functionality"""
-        # Test IP not in log
+        # Test IP not in log: starts with a full bucket and takes one token
         ip = "192.168.1.1"
         assert security_manager.rate_limit_check(ip) is True
+        assert security_manager.request_log[ip] == [59, _NOW]
         
         # Test rate limit not exceeded
-        security_manager.request_log[ip] = [(time.time() - 10) for _ in range(5)]
+        security_manager.request_log[ip] = [5, _NOW - 10]
         assert security_manager.rate_limit_check(ip) is True
         
         # Test rate limit exceeded
-        security_manager.request_log[ip] = [(time.time() - 1) for _ in range(100)]
+        security_manager.request_log[ip] = [0.5, _NOW]
+        assert security_manager.rate_limit_check(ip) is False
+        
+        # Test an idle IP's bucket refills, but never past the limit
+        security_manager.request_log[ip] = [0, _NOW - 3600]
+        assert security_manager.rate_limit_check(ip) is True
+        assert security_manager.request_log[ip] == [59, _NOW]
+    
+    def test_rate_limit_refills_at_limit_per_minute(self, security_manager, frozen_clock):
+        """Test that an empty bucket gets one token back per 60 / limit seconds"""
+        ip = "192.168.1.2"
+        bucket = [0, _NOW - 0.5]
+        security_manager.request_log[ip] = bucket
+        
+        # Half a token refilled: still limited, and the partial token is kept
         assert security_manager.rate_limit_check(ip) is False
+        assert bucket == [0.5, _NOW]
         
-        # Test old requests are cleaned up
-        old_time = time.time() - 3600  # 1 hour ago
-        security_manager.request_log[ip] = [old_time for _ in range(100)]
+        # Another second of refill allows exactly one more request
+        bucket[1] = _NOW - 1
         assert security_manager.rate_limit_check(ip) is True
-        assert len(security_manager.request_log[ip]) < 100
+        assert security_manager.request_log[ip] is bucket
+        assert bucket[0] == pytest.approx(0.5)
+    
+    def test_rate_limit_is_thread_safe(self, security_manager, frozen_clock):
+        """Test that concurrent checks for one IP never hand out more than the limit"""
+        ip = "192.168.1.3"
+        barrier = threading.Barrier(8)
+        
+        def check_many():
+            barrier.wait()
+            return sum(security_manager.rate_limit_check(ip) for _ in range(20))
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            allowed = sum(pool.map(lambda _: check_many(), range(8)))
+        
+        # 160 checks against a full 60-token bucket and a stopped clock
+        assert allowed == 60
+        
+        # Different IPs mostly map to different locks
+        assert len({id(security_manager._stripe(f"10.0.0.{i}")) for i in range(32)}) > 1
+    
+    def test_redis_backed_state(self):
+        """Test that a Redis client takes over rate-limit and login state via its scripts"""
+        client = MagicMock()
+        scripts = {}
+        client.register_script.side_effect = lambda source: scripts.setdefault(source, MagicMock(return_value=1))
+        security = SecurityManager(redis_client=client)
+        rate_limit, validate_login, record_failure = scripts.values()
+        
+        assert security.rate_limit_check("10.0.0.1") is True
+        rate_limit.assert_called_once_with(keys=["deal-finder:security:rate:10.0.0.1"], args=[60])
+        
+        validate_login.return_value = 0
+        assert security.validate_login_attempt("a:b", "::1") is False
+        login_keys = ["deal-finder:security:login:3:a:b:::1:count", "deal-finder:security:login:3:a:b:::1:lockout"]
+        validate_login.assert_called_once_with(keys=login_keys, args=[5, 15 * 60])
+        
+        security.record_failed_login("a:b", "::1")
+        record_failure.assert_called_once_with(keys=login_keys, args=[60 * 60])
+        
+        security.reset_login_attempts("a:b", "::1")
+        client.delete.assert_called_once_with(*login_keys)
+        
+        # Nothing is kept in process
+        assert security.request_log == {} and security.login_attempts == {}
+    
+    def test_sweep_idle_state(self, security_manager, frozen_clock):
+        """Test that sweeping keeps only state that still affects a check"""
+        # Least recently checked first, as rate_limit_check keeps them
+        security_manager.request_log.update({
+            "10.0.0.2": [3, _NOW - 60],  # refilled; same as a new IP
+            "10.0.0.1": [3, _NOW - 5],  # still refilling
+        })
+        security_manager.login_attempts.update({
+            ("locked", "ip"): {"count": 5, "lockout_until": _NOW + 300},
+            ("lockout-over", "ip"): {"count": 5, "lockout_until": _NOW - 300},
+            ("recent", "ip"): {"count": 2, "lockout_until": None, "last_failure": _NOW - 300},
+            ("stale", "ip"): {"count": 2, "lockout_until": None, "last_failure": _NOW - 7200},
+            ("reset", "ip"): {"count": 0, "lockout_until": None},
+        })
+        
+        security_manager.sweep_idle_state()
+        
+        assert list(security_manager.request_log) == ["10.0.0.1"]
+        assert sorted(security_manager.login_attempts) == [("locked", "ip"), ("recent", "ip")]
+    
+    def test_sweep_stops_at_first_recent_ip(self, security_manager, frozen_clock):
+        """Test that a check moves its IP to the end, and the sweep only pops idle IPs from the front"""
+        security_manager.request_log.update({
+            "10.0.0.1": [3, _NOW - 120],
+            "10.0.0.2": [3, _NOW - 90],
+            "10.0.0.3": [3, _NOW - 70],
+        })
+        security_manager.rate_limit_check("10.0.0.1")
+        assert list(security_manager.request_log) == ["10.0.0.2", "10.0.0.3", "10.0.0.1"]
+        
+        security_manager.sweep_idle_state()
+        assert list(security_manager.request_log) == ["10.0.0.1"]
+    
+    def test_sweep_runs_every_interval(self, security_manager, frozen_clock):
+        """Test that checks trigger a sweep once every STATE_SWEEP_INTERVAL calls"""
+        security_manager._sweep_counter = 0
+        with patch("utils.security.STATE_SWEEP_INTERVAL", 3), \
+             patch.object(security_manager, "sweep_idle_state") as sweep:
+            security_manager.rate_limit_check("10.0.0.1")
+            security_manager.validate_login_attempt("user", "10.0.0.1")
+            sweep.assert_not_called()
+            
+            security_manager.rate_limit_check("10.0.0.1")
+            sweep.assert_called_once()
+    
+    def test_reload_config(self, security_manager, frozen_clock):
+        """Test that checks use the settings read at init until reload_config is called"""
+        rate_limiting = {"enabled": True, "max_requests_per_minute": 1}
+        ip = "192.168.1.3"
+        try:
+            with patch.dict("utils.security.SECURITY", {"rate_limiting": rate_limiting}):
+                security_manager.request_log[ip] = [0, _NOW]
+                assert security_manager.rate_limit_check(ip) is False
+                
+                rate_limiting["enabled"] = False
+                assert security_manager.rate_limit_check(ip) is False
+                security_manager.reload_config()
+                assert security_manager.rate_limit_check(ip) is True
+        finally:
+            security_manager.reload_config()
+    
+    def test_encryption_disabled_passes_data_through(self, security_manager):
+        """Test that disabling encryption swaps the methods for pass-throughs until re-enabled"""
+        try:
+            with patch.dict("utils.security.SECURITY", {"api_key_encryption": False}):
+                security_manager.reload_config()
+                assert security_manager.encrypt_data("plain") == "plain"
+                assert security_manager.decrypt_data("plain") == "plain"
+                assert security_manager.encrypt_data_raw(b"plain") == b"plain"
+                assert security_manager.decrypt_data_raw(b"plain") == b"plain"
+                assert security_manager.encrypt_bulk(b"plain") == b"plain"
+        finally:
+            security_manager.reload_config()
+        
+        assert security_manager.decrypt_data(security_manager.encrypt_data("plain")) == "plain"
+        assert security_manager.encrypt_data("plain") != "plain"
     
     def test_login_attempt_validation(self, security_manager):
         """Test login attempt validation"""
@@ -90,6 +334,23 @@ class TestSecurityManager:
         with patch.object(security_manager, 'validate_login_attempt', return_value=False):
             assert security_manager.validate_login_attempt(username, ip) is False
     
+    def test_login_lockout(self, security_manager, frozen_clock):
+        """Test that too many failures lock the user out until the lockout expires"""
+        username = "testuser"
+        ip = "192.168.1.1"
+        key = (username, ip)
+        for _ in range(5):
+            security_manager.record_failed_login(username, ip)
+        
+        assert security_manager.validate_login_attempt(username, ip) is False
+        assert security_manager.login_attempts[key]["lockout_until"] == _NOW + 15 * 60
+        assert security_manager.validate_login_attempt(username, ip) is False
+        
+        # Once the lockout has passed, the count starts over
+        security_manager.login_attempts[key]["lockout_until"] = _NOW
+        assert security_manager.validate_login_attempt(username, ip) is True
+        assert security_manager.login_attempts[key] == {"count": 0, "lockout_until": None}
+    
     def test_record_failed_login(self, security_manager):
         """Test recording failed login attempts"""
         username = "testuser"
@@ -99,7 +360,7 @@ class TestSecurityManager:
         security_manager.record_failed_login(username, ip)
         
         # Verify the login attempt was recorded
-        key = f"{username}:{ip}"
+        key = (username, ip)
         assert key in security_manager.login_attempts
         assert security_manager.login_attempts[key]["count"] == 1
     
@@ -109,7 +370,7 @@ class TestSecurityManager:
         ip = "192.168.1.1"
         
         # Setup failed attempts
-        key = f"{username}:{ip}"
+        key = (username, ip)
         security_manager.login_attempts[key] = {
             "count": 3,
             "lockout_until": time.time() + 600
@@ -126,15 +387,50 @@ class TestSecurityManager:
     def test_csrf_token(self, security_manager):
         """Test CSRF token generation and validation"""
         # Generate token
-        token = security_manager.generate_csrf_token()
+        token = security_manager.generate_csrf_token("session-1")
         assert token is not None
         assert isinstance(token, str)
+        # 32-byte MAC, URL-safe base64 without padding
+        assert len(token) == 43
+        assert base64.urlsafe_b64decode(token + "=") != b""
+        
+        # Stateless: the same session always gets the same token, another session a different one
+        assert security_manager.generate_csrf_token("session-1") == token
+        assert security_manager.generate_csrf_token("session-2") != token
         
         # Validate correct token
-        assert security_manager.validate_csrf_token(token, token) is True
+        assert security_manager.validate_csrf_token("session-1", token) is True
+        
+        # Validate incorrect token, and a token from another session
+        assert security_manager.validate_csrf_token("session-1", "invalid_token") is False
+        assert security_manager.validate_csrf_token("session-2", token) is False
+        assert security_manager.validate_csrf_token("", token) is False
+        
+        # Non-ASCII input is rejected rather than raising
+        assert security_manager.validate_csrf_token("session-1", "tökén") is False
+    
+    def test_csrf_token_uses_constant_time_comparison(self, security_manager):
+        """Test that CSRF validation compares tokens with hmac.compare_digest"""
+        token = security_manager.generate_csrf_token("session-1")
+        
+        with patch("utils.security.hmac.compare_digest", wraps=hmac.compare_digest) as compare_digest:
+            assert security_manager.validate_csrf_token("session-1", token) is True
+            compare_digest.assert_called_once()
+            
+            # A token of the wrong length is rejected without comparing
+            assert security_manager.validate_csrf_token("session-1", token[:-1]) is False
+            compare_digest.assert_called_once()
+    
+    def test_csrf_token_falls_back_to_hmac(self, security_manager):
+        """Test that CSRF tokens use HMAC-SHA256 when keyed BLAKE2b isn't available"""
+        blake2b_token = security_manager.generate_csrf_token("session-1")
+        
+        with patch("utils.security._blake2b", None):
+            token = security_manager.generate_csrf_token("session-1")
+            assert security_manager.validate_csrf_token("session-1", token) is True
         
-        # Validate incorrect token
-        assert security_manager.validate_csrf_token(token, "invalid_token") is False
+        assert len(token) == 43
+        assert token != blake2b_token
     
     def test_sanitize_input(self, security_manager):
         """Test input sanitization"""
@@ -147,12 +443,28 @@ class TestSecurityManager:
         normal_input = "Hello, world!"
         sanitized = security_manager.sanitize_input(normal_input)
         assert sanitized == normal_input
+        
+        # Test every escaped character
+        sanitized = security_manager.sanitize_input("""<a href="x" onclick='y'>;""")
+        assert sanitized == "&lt;a href=&quot;x&quot; onclick=&#39;y&#39;&gt;&#59;"
+        
+        # Test empty input
+        assert security_manager.sanitize_input(None) == ""
     
     def test_secure_headers(self, security_manager):
         """Test secure headers generation"""
         headers = security_manager.get_secure_headers()
         
         # Check essential security headers
-        assert isinstance(headers, dict)
+        assert isinstance(headers, Mapping)
         assert len(headers) > 0
-        assert "Content-Security-Policy" in headers 
\ No newline at end of file
+        assert "Content-Security-Policy" in headers
+        
+        # The same read-only mapping is returned every time
+        assert security_manager.get_secure_headers() is headers
+        with pytest.raises(TypeError):
+            headers["X-Frame-Options"] = "ALLOW" 
+        
+        # It is a snapshot, so later changes to the config don't show through
+        with patch.dict(SECURITY["headers"], {"X-Frame-Options": "ALLOW"}):
+            assert headers["X-Frame-Options"] == "DENY"
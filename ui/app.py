@@ -13,15 +13,16 @@ try:
     # Now import the rest
     import streamlit as st
     import pandas as pd
+    import numpy as np
     import json
+    import importlib
+    import hashlib
+    import pickle
     from utils.ai_helper import parse_user_query, rank_recommendations
-    from utils.location import get_user_location
-    from scrapers.sites.ebay import EbayScraper
-    from scrapers.sites.facebook import FacebookMarketplaceScraper
-    from scrapers.sites.newegg import NeweggScraper
+    from utils.location import get_user_location, get_location_by_address
+    from scrapers.search import iter_site_results
     from utils.config import SITES, MAX_RESULTS_PER_SITE
     from streamlit_tags import st_tags
-    from streamlit_card import card
     from streamlit_extras.colored_header import colored_header
     from streamlit_extras.add_vertical_space import add_vertical_space
     import time
@@ -50,61 +51,276 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Custom CSS for improved styling
-st.markdown("""
-<style>
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 10px;
-    }
-    .stTabs [data-baseweb="tab"] {
-        background-color: #f0f2f6;
-        border-radius: 4px 4px 0px 0px;
-        padding: 10px 16px;
-        border: none;
-    }
-    .stTabs [aria-selected="true"] {
-        background-color: #4e8df5 !important;
-        color: white !important;
-    }
-    .product-card {
-        border: 1px solid #e6e6e6;
-        border-radius: 10px;
-        padding: 15px;
-        margin-bottom: 15px;
-        transition: transform 0.3s ease, box-shadow 0.3s ease;
-    }
-    .product-card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 10px 20px rgba(0,0,0,0.1);
-    }
-    .source-tag {
-        font-size: 12px;
-        font-weight: bold;
-        padding: 3px 8px;
-        border-radius: 10px;
-        color: white;
-    }
-    .source-ebay {
-        background-color: #e53238;
-    }
-    .source-facebook {
-        background-color: #3b5998;
-    }
-    .source-newegg {
-        background-color: #ff6600;
-    }
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        margin-bottom: 1rem;
-    }
-    .subheader {
-        font-size: 1.5rem;
-        font-weight: 500;
-        margin-bottom: 1rem;
-    }
-</style>
-""", unsafe_allow_html=True)
+@st.cache_resource
+def load_css():
+    """Read the app stylesheet once per server process"""
+    with open(os.path.join(os.path.dirname(__file__), 'styles.css'), encoding='utf-8') as f:
+        return f"<style>{f.read()}</style>"
+
+# Custom CSS for improved styling; Streamlit clears elements that aren't
+# re-emitted, so this runs every rerun, but the file is only read once
+st.markdown(load_css(), unsafe_allow_html=True)
+
+# Scraper module and class, imported on first search, and display name for
+# each supported platform
+SCRAPER_CLASSES = {
+    "ebay": ("scrapers.sites.ebay", "EbayScraper"),
+    "facebook": ("scrapers.sites.facebook", "FacebookMarketplaceScraper"),
+    "newegg": ("scrapers.sites.newegg", "NeweggScraper"),
+}
+SITE_NAMES = {
+    "ebay": "eBay",
+    "facebook": "Facebook Marketplace",
+    "newegg": "Newegg",
+}
+
+# Card badge CSS class for each source; anything else gets source-other
+SOURCE_CLASSES = {
+    "ebay": "source-ebay",
+    "facebook": "source-facebook",
+    "newegg": "source-newegg",
+}
+
+# Result cards shown per page in the card view
+CARDS_PER_PAGE = 12
+
+# Seconds a site's results are reused for an identical search
+SEARCH_CACHE_TTL = 600
+
+# AI ranking sees at most this many candidates per result slot shown
+RANK_CANDIDATES_FACTOR = 4
+
+# Seconds a detected or looked-up location is reused
+LOCATION_CACHE_TTL = 86400
+
+class _UncachedResult(Exception):
+    """Carries a result out of a st.cache_data function so it is not cached"""
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+def get_scraper_class(site):
+    """
+    Import a site's scraper class on first use
+    
+    Scrapers pull in Selenium and the HTML parsing stack, so they are only
+    imported once a search actually needs them. Later calls hit sys.modules.
+    
+    Args:
+        site (str): Platform key from SCRAPER_CLASSES
+        
+    Returns:
+        type: The scraper class for the site
+    """
+    module_name, class_name = SCRAPER_CLASSES[site]
+    return getattr(importlib.import_module(module_name), class_name)
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def _cached_site_search(site, keywords, max_price, condition, location):
+    """Run one site's search, memoized on the site, keywords and filters"""
+    results = get_scraper_class(site)().search(
+        keywords,
+        max_price=max_price,
+        condition=condition,
+        location=location
+    )
+    if not results:
+        # Empty results may be a failed scrape; retry next time
+        raise _UncachedResult(results)
+    return results
+
+class CachedScraper:
+    """Scraper stand-in whose search() goes through the per-site result cache"""
+    
+    def __init__(self, site):
+        self.site = site
+    
+    def search(self, keywords, max_price=None, condition=None, location=None):
+        try:
+            return _cached_site_search(self.site, keywords, max_price, condition, location)
+        except _UncachedResult as uncached:
+            return uncached.result
+
+@st.cache_data(persist="disk", show_spinner=False)
+def _cached_parse(query_text, budget):
+    """Parse a query with AI, persisted on disk so it survives app restarts"""
+    parsed_query = parse_user_query(query_text, budget)
+    if not parsed_query.get("success"):
+        # Fallback structure from a failed AI call; retry next time
+        raise _UncachedResult(parsed_query)
+    return parsed_query
+
+def parse_query(query_text, budget):
+    """Parse a query with AI, reusing the result for an identical query and budget"""
+    try:
+        return _cached_parse(query_text, budget)
+    except _UncachedResult as uncached:
+        return uncached.result
+
+def _content_key(obj):
+    """Hash a picklable object's contents with blake2b for use as a cache key"""
+    return hashlib.blake2b(pickle.dumps(obj, protocol=5), digest_size=16).hexdigest()
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def _cached_rank(results_key, query_key, _results, _parsed_query):
+    """
+    Rank results with AI, memoized on content hashes of the results and query
+    
+    Streamlit skips hashing arguments that start with an underscore, so the
+    result list is hashed once with blake2b instead of walked by the cache.
+    """
+    ranked = rank_recommendations(_results, _parsed_query)
+    if not any("rank_score" in product for product in ranked):
+        # The models failed and this is the price-sorted fallback; don't keep it
+        raise _UncachedResult(ranked)
+    return ranked
+
+def rank_results(results, parsed_query):
+    """Rank results with AI, reusing the ranking for an identical result set and query"""
+    try:
+        return _cached_rank(_content_key(results), _content_key(parsed_query), results, parsed_query)
+    except _UncachedResult as uncached:
+        return uncached.result
+
+@st.cache_data(ttl=LOCATION_CACHE_TTL, show_spinner=False)
+def _cached_user_location():
+    """Detect the location from the server's IP, shared by all sessions"""
+    location = get_user_location()
+    if not location:
+        # Failed lookup; retry next time
+        raise _UncachedResult(location)
+    return location
+
+def detect_user_location():
+    """Detect the user's location, reusing the last successful lookup"""
+    try:
+        return _cached_user_location()
+    except _UncachedResult as uncached:
+        return uncached.result
+
+@st.cache_data(ttl=LOCATION_CACHE_TTL, show_spinner=False)
+def _cached_address_location(address):
+    """Look up a typed address, memoized on the address string"""
+    location = get_location_by_address(address)
+    if not location:
+        # Not found or geocoder error; retry next time
+        raise _UncachedResult(location)
+    return location
+
+def lookup_address(address):
+    """Look up a typed address, reusing the result for a repeated address"""
+    try:
+        return _cached_address_location(address)
+    except _UncachedResult as uncached:
+        return uncached.result
+
+def sort_by_price(results, descending=False):
+    """
+    Sort results by price with one NumPy argsort over all prices
+    
+    Results without a price go last in either direction. Ties keep their
+    original order.
+    
+    Args:
+        results (list): Product dictionaries
+        descending (bool): Sort from highest to lowest price
+        
+    Returns:
+        list: The same products in price order
+    """
+    missing = -np.inf if descending else np.inf
+    prices = np.fromiter(
+        (missing if r.get('price') is None else r['price'] for r in results),
+        dtype=np.float64,
+        count=len(results)
+    )
+    order = np.argsort(-prices if descending else prices, kind="stable")
+    return [results[i] for i in order]
+
+def product_link(product):
+    """Product page URL; eBay and Newegg's fallback parsers store it as 'url', the rest as 'link'"""
+    return product.get('link') or product.get('url')
+
+def filter_by_price(results, max_price):
+    """
+    Drop over-budget and incomplete products with one NumPy mask
+    
+    Applied as each site returns, so nothing downstream (ranking, sorting,
+    rendering) spends time on products that can't be shown.
+    
+    Args:
+        results (list): Product dictionaries from one scraper
+        max_price (float): Budget; None or 0 (no budget) skips the price check
+        
+    Returns:
+        list: Products with a title and link, priced at or under max_price
+    """
+    keep = np.fromiter(
+        (bool(r.get('title')) and bool(product_link(r)) for r in results),
+        dtype=bool,
+        count=len(results)
+    )
+    if max_price:
+        # Products without a price can't be shown to fit the budget
+        prices = np.fromiter(
+            (np.inf if r.get('price') is None else r['price'] for r in results),
+            dtype=np.float64,
+            count=len(results)
+        )
+        keep &= prices <= max_price
+    return [r for r, kept in zip(results, keep) if kept]
+
+def dedupe_results(results):
+    """
+    Drop repeated listings, keeping the first occurrence
+    
+    Listings match on their case- and whitespace-normalized title and price
+    rounded to the dollar.
+    
+    Args:
+        results (list): Product dictionaries from all sites
+        
+    Returns:
+        list: Products with duplicates removed, in their original order
+    """
+    seen = set()
+    deduped = []
+    for r in results:
+        key = (" ".join((r.get('title') or '').lower().split()), round(r.get('price') or 0))
+        if key not in seen:
+            seen.add(key)
+            deduped.append(r)
+    return deduped
+
+def shortlist_for_ranking(results, max_price, limit):
+    """
+    Cut results down to a bounded window before AI ranking
+    
+    Uses a cheap NumPy mask: products within budget come first, keeping their
+    original order, then the list is truncated to limit.
+    
+    Args:
+        results (list): Product dictionaries
+        max_price (float): Budget; None keeps the original order
+        limit (int): Maximum number of products to keep
+        
+    Returns:
+        list: At most limit products
+    """
+    if len(results) <= limit:
+        return results
+    if max_price is None:
+        return results[:limit]
+    
+    prices = np.fromiter(
+        (np.nan if r.get('price') is None else r['price'] for r in results),
+        dtype=np.float64,
+        count=len(results)
+    )
+    # NaN compares False, so unpriced products rank behind in-budget ones
+    in_budget = prices <= max_price
+    order = np.argsort(~in_budget, kind="stable")[:limit]
+    return [results[i] for i in order]
 
 def main():
     try:
@@ -137,20 +353,19 @@ def main():
             # Location settings
             st.markdown("### Location Settings")
             
-            # Get user location if not already in session state
-            if 'location' not in st.session_state:
-                with st.spinner("Detecting your location..."):
-                    st.session_state.location = get_user_location()
-            
-            location = st.session_state.location
-            
             # Add manual location override option
             use_manual_location = st.checkbox("Specify my location manually", 
                                                   help="Use this if your location was detected incorrectly")
             
+            # Get user location if not already in session state; skip the
+            # lookup when the user is entering one by hand
+            if 'location' not in st.session_state and not use_manual_location:
+                with st.spinner("Detecting your location..."):
+                    st.session_state.location = detect_user_location()
+            
+            location = st.session_state.get('location')
+            
             if use_manual_location:
-                from utils.location import get_location_by_address
-                
                 col1, col2 = st.columns([3, 1])
                 with col1:
                     location_input = st.text_input(
@@ -163,7 +378,7 @@ def main():
                 
                 if location_input and lookup_button:
                     with st.spinner("Looking up location..."):
-                        manual_location = get_location_by_address(location_input)
+                        manual_location = lookup_address(location_input)
                         if manual_location:
                             st.session_state.location = manual_location
                             location = manual_location
@@ -181,50 +396,53 @@ def main():
             else:
                 st.warning("Location detection failed. Using general search.")
         
-        # Main content area
-        col1, col2 = st.columns([2, 1])
-        
-        with col1:
-            # Query input section
-            colored_header(label="What are you looking for?", description="Describe the tech product you want to find", color_name="blue-70")
+        # Main content area; the inputs sit in a form so editing them
+        # doesn't rerun the app until Search or Clear is pressed
+        with st.form("search_form", clear_on_submit=False):
+            col1, col2 = st.columns([2, 1])
             
-            query = st.text_area(
-                "Describe what you want to find in detail",
-                placeholder="e.g., 'gaming laptop with RTX graphics card under $1200' or 'used iPhone 13 in good condition'",
-                height=100
-            )
+            with col1:
+                # Query input section
+                colored_header(label="What are you looking for?", description="Describe the tech product you want to find", color_name="blue-70")
+                
+                query = st.text_area(
+                    "Describe what you want to find in detail",
+                    placeholder="e.g., 'gaming laptop with RTX graphics card under $1200' or 'used iPhone 13 in good condition'",
+                    height=100
+                )
+                
+                # Additional tags for keywords
+                additional_keywords = st_tags(
+                    label="Add specific keywords (optional)",
+                    text="Press enter to add more",
+                    value=[],
+                    suggestions=["gaming", "laptop", "phone", "tablet", "headphones", "camera"],
+                    maxtags=5
+                )
             
-            # Additional tags for keywords
-            additional_keywords = st_tags(
-                label="Add specific keywords (optional)",
-                text="Press enter to add more",
-                value=[],
-                suggestions=["gaming", "laptop", "phone", "tablet", "headphones", "camera"],
-                maxtags=5
-            )
+            with col2:
+                # Search button and advanced options
+                add_vertical_space(2)
+                
+                st.info("💡 **Tip**: Be specific about features, brands, and condition to get better results.")
+                
+                # Advanced options expander
+                with st.expander("Advanced Options"):
+                    sort_by = st.radio("Sort Results By", ["AI Recommendation", "Price (Low to High)", "Price (High to Low)"], index=0)
+                    max_results = st.slider("Maximum Results per Site", 10, MAX_RESULTS_PER_SITE, 20)
+                
+                # Search button
+                search_col1, search_col2 = st.columns([3, 1])
+                with search_col1:
+                    search_button = st.form_submit_button("🔍 Search Deals", type="primary", use_container_width=True)
+                with search_col2:
+                    clear_button = st.form_submit_button("Clear", type="secondary", use_container_width=True)
         
-        with col2:
-            # Search button and advanced options
-            add_vertical_space(2)
-            
-            st.info("💡 **Tip**: Be specific about features, brands, and condition to get better results.")
-            
-            # Advanced options expander
-            with st.expander("Advanced Options"):
-                sort_by = st.radio("Sort Results By", ["AI Recommendation", "Price (Low to High)", "Price (High to Low)"], index=0)
-                max_results = st.slider("Maximum Results per Site", 10, MAX_RESULTS_PER_SITE, 20)
-            
-            # Search button
-            search_col1, search_col2 = st.columns([3, 1])
-            with search_col1:
-                search_button = st.button("🔍 Search Deals", type="primary", use_container_width=True)
-            with search_col2:
-                clear_button = st.button("Clear", type="secondary", use_container_width=True)
-                if clear_button:
-                    # Clear results if they exist
-                    if 'search_results' in st.session_state:
-                        del st.session_state.search_results
-                    st.experimental_rerun()
+        if clear_button:
+            # Clear results if they exist
+            if 'search_results' in st.session_state:
+                del st.session_state.search_results
+            st.experimental_rerun()
         
         # Process search when button is clicked
         if search_button:
@@ -259,7 +477,7 @@ def main():
                 status_text.text("Analyzing your request with AI...")
                 progress_bar.progress(10)
                 
-                parsed_query = parse_user_query(full_query, budget)
+                parsed_query = parse_query(full_query, budget)
                 progress_bar.progress(30)
                 
                 # Create expandable debug section
@@ -283,72 +501,51 @@ def main():
                     if not search_condition or search_condition == 'any':
                         search_condition = condition.lower() if condition.lower() != 'any' else None
                     
-                    # Start collecting results from selected platforms
-                    all_results = []
+                    # Step 2: Search all selected platforms concurrently
+                    status_text.text("Searching " + ", ".join(SITE_NAMES[name] for name in active_platforms) + "...")
+                    progress_bar.progress(40)
                     
-                    # Step 2: Search eBay if enabled
-                    if "ebay" in active_platforms:
-                        status_text.text("Searching eBay...")
-                        progress_bar.progress(40)
-                        
-                        ebay_scraper = EbayScraper()
-                        ebay_results = ebay_scraper.search(
-                            search_keywords, 
-                            max_price=max_price, 
-                            condition=search_condition,
-                            location=location
-                        )
-                        
-                        logger.info(f"Found {len(ebay_results)} results from eBay")
-                        all_results.extend(ebay_results)
-                        progress_bar.progress(60)
+                    # Repeat searches within SEARCH_CACHE_TTL reuse each site's results
+                    scrapers = {name: CachedScraper(name) for name in active_platforms}
+                    site_results_iter = iter_site_results(
+                        search_keywords,
+                        scrapers,
+                        max_price=max_price,
+                        condition=search_condition,
+                        location=location
+                    )
                     
-                    # Step 3: Search Facebook if enabled
-                    if "facebook" in active_platforms:
-                        status_text.text("Searching Facebook Marketplace...")
-                        progress_bar.progress(70)
-                        
-                        facebook_scraper = FacebookMarketplaceScraper()
-                        facebook_results = facebook_scraper.search(
-                            search_keywords, 
-                            max_price=max_price, 
-                            condition=search_condition,
-                            location=location
-                        )
-                        
-                        logger.info(f"Found {len(facebook_results)} results from Facebook")
-                        all_results.extend(facebook_results)
-                        progress_bar.progress(85)
+                    # Collect each site's results as soon as it finishes and show
+                    # a preview, so the fastest site's products appear right away
+                    all_results = []
+                    results_placeholder = st.empty()
+                    for done, (name, site_results) in enumerate(site_results_iter, start=1):
+                        logger.info(f"Found {len(site_results)} results from {SITE_NAMES[name]}")
+                        all_results.extend(filter_by_price(site_results, max_price))
+                        progress_bar.progress(40 + 50 * done // len(scrapers))
+                        results_placeholder.markdown(card_grid_html(all_results[:CARDS_PER_PAGE]), unsafe_allow_html=True)
                     
-                    # Step 4: Search Newegg if enabled
-                    if "newegg" in active_platforms:
-                        status_text.text("Searching Newegg...")
-                        progress_bar.progress(85)
-                        
-                        newegg_scraper = NeweggScraper()
-                        newegg_results = newegg_scraper.search(
-                            search_keywords, 
-                            max_price=max_price, 
-                            condition=search_condition,
-                            location=location
-                        )
-                        
-                        logger.info(f"Found {len(newegg_results)} results from Newegg")
-                        all_results.extend(newegg_results)
-                        progress_bar.progress(90)
+                    # Cross-site duplicates would otherwise take up ranking and display slots
+                    all_results = dedupe_results(all_results)
                     
-                    # Step 5: Rank results if we have enough products
+                    # Step 3: Rank results if we have enough products
                     if len(all_results) > 3:
                         status_text.text("Ranking recommendations for you...")
                         
                         # Apply sorting based on user selection
                         if sort_by == "AI Recommendation" and len(all_results) > 3:
                             progress_bar.progress(95)
-                            all_results = rank_recommendations(all_results, parsed_query)
+                            # Bound the ranker's input regardless of how much the scrapers returned
+                            candidates = shortlist_for_ranking(
+                                all_results,
+                                max_price,
+                                RANK_CANDIDATES_FACTOR * max_results * len(active_platforms)
+                            )
+                            all_results = rank_results(candidates, parsed_query)
                         elif sort_by == "Price (Low to High)":
-                            all_results.sort(key=lambda x: x.get('price', 9999))
+                            all_results = sort_by_price(all_results)
                         elif sort_by == "Price (High to Low)":
-                            all_results.sort(key=lambda x: x.get('price', 0), reverse=True)
+                            all_results = sort_by_price(all_results, descending=True)
                     
                     # Cap the results per user selection
                     all_results = all_results[:max_results*len(active_platforms)]
@@ -362,6 +559,7 @@ def main():
                     time.sleep(0.5)  # Brief pause to show completion
                     status_text.empty()
                     progress_bar.empty()
+                    results_placeholder.empty()
                     
                     # Display results
                     display_search_results(all_results, parsed_query)
@@ -380,6 +578,72 @@ def main():
         st.error("Please check the logs for more details.")
 
 
+def results_table(results):
+    """
+    Get the formatted table for a result list, building it once per list
+    
+    Streamlit reruns the script on every widget change, so the DataFrame is
+    kept in session state and only rebuilt when a different result list is shown.
+    """
+    # Compare by identity: the stored list stays referenced, so it can't be
+    # confused with a new list that reuses its id
+    if st.session_state.get('_table_source') is not results:
+        # Convert to DataFrame for display
+        df = pd.DataFrame(results)
+        
+        # Format the DataFrame
+        if 'price' in df.columns:
+            # Format the whole column at once; missing or non-numeric prices show N/A
+            prices = pd.to_numeric(df['price'], errors='coerce')
+            df['price'] = np.where(prices.notna(), np.char.mod("$%.2f", prices.to_numpy()), "N/A")
+        
+        display_columns = [col for col in ['title', 'price', 'condition', 'source'] if col in df.columns]
+        st.session_state['_table_source'] = results
+        st.session_state['results_df'] = df[display_columns]
+    
+    return st.session_state['results_df']
+
+def render_card_view(results):
+    """Render one page of result cards, CARDS_PER_PAGE at a time"""
+    st.markdown("### Top Recommendations")
+    
+    # Only build the cards for the selected page
+    num_pages = -(-len(results) // CARDS_PER_PAGE)
+    page = 1
+    if num_pages > 1:
+        page = st.selectbox("Page", range(1, num_pages + 1), format_func=lambda p: f"Page {p} of {num_pages}")
+    page_results = results[(page - 1) * CARDS_PER_PAGE:page * CARDS_PER_PAGE]
+    
+    # Send the whole page as one HTML grid in a single message
+    st.markdown(card_grid_html(page_results), unsafe_allow_html=True)
+
+def card_grid_html(products):
+    """Build the HTML for a grid of result cards"""
+    html_parts = ['<div class="card-grid">']
+    for product in products:
+        # Read each field once
+        source = product.get('source', '')
+        title = product.get('title', 'Product')
+        price = product.get('price', 0)
+        product_condition = product.get('condition', 'Not specified')
+        
+        # Determine source for styling
+        source_class = SOURCE_CLASSES.get(source, 'source-other')
+        
+        html_parts.append(
+            '<div class="product-card">'
+            f'<span class="source-tag {source_class}">{source.upper()}</span>'
+            f"<h3>{title}</h3>"
+            f'<h2 style="color: #4CAF50;">${price:.2f}</h2>'
+            f"<p><strong>Condition:</strong> {product_condition}</p>"
+        )
+        link = product_link(product)
+        if link:
+            html_parts.append(f'<a href="{link}" target="_blank">View Details</a>')
+        html_parts.append('</div>')
+    html_parts.append('</div>')
+    return "".join(html_parts)
+
 def display_search_results(results, parsed_query):
     """Display search results with improved UI"""
     if not results:
@@ -389,48 +653,14 @@ def display_search_results(results, parsed_query):
     # Show success message with result count
     st.success(f"✅ Found {len(results)} results")
     
-    # Create tabs for different views
-    tab1, tab2 = st.tabs(["Card View", "Table View"])
+    # Choose a view; unlike tabs, only the selected view is built on each rerun
+    view = st.radio("View", ["Card View", "Table View"], horizontal=True, label_visibility="collapsed")
     
-    with tab1:
-        # Card view
-        st.markdown("### Top Recommendations")
-        
-        # Create cards in rows of 3
-        for i in range(0, len(results), 3):
-            cols = st.columns(3)
-            for j in range(3):
-                if i+j < len(results):
-                    product = results[i+j]
-                    with cols[j]:
-                        # Determine source for styling
-                        source_class = f"source-{product.get('source', 'other')}"
-                        
-                        # Create card
-                        with st.container():
-                            st.markdown(f"""
-                            <div class="product-card">
-                                <span class="source-tag {source_class}">{product.get('source', '').upper()}</span>
-                                <h3>{product.get('title', 'Product')}</h3>
-                                <h2 style="color: #4CAF50;">${product.get('price', 0):.2f}</h2>
-                                <p><strong>Condition:</strong> {product.get('condition', 'Not specified')}</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            if 'link' in product:
-                                st.markdown(f"[View Details]({product['link']})")
-    
-    with tab2:
+    if view == "Card View":
+        render_card_view(results)
+    else:
         # Table view
-        # Convert to DataFrame for display
-        df = pd.DataFrame(results)
-        
-        # Format the DataFrame
-        if 'price' in df.columns:
-            df['price'] = df['price'].apply(lambda x: f"${x:.2f}" if pd.notnull(x) else "N/A")
-        
-        display_columns = [col for col in ['title', 'price', 'condition', 'source'] if col in df.columns]
-        st.dataframe(df[display_columns], use_container_width=True)
+        st.dataframe(results_table(results), use_container_width=True)
     
     # Additional information about the search
     with st.expander("Search Details"):
@@ -1,21 +1,296 @@
 import os
+import re
+import asyncio
+import copy
 import json
-import google.generativeai as genai
+import functools
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from google.api_core.exceptions import InvalidArgument, ResourceExhausted, ServiceUnavailable
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 import logging
 from loguru import logger
+from utils.config import GEMINI_RPM
+from utils.rate_limit import TokenBucket
 
-# Configure the Gemini API with the API key
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# orjson is optional; fall back to the standard library when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Set the model constant to use throughout
 GEMINI_MODEL = "gemini-2.0-flash"
 FALLBACK_MODEL = "gemini-2.0-flash-lite"
 
+# Transient API errors that are retried on the same model before falling back
+_RETRYABLE_ERRORS = (ResourceExhausted, ServiceUnavailable)
+
+# Attempts per model call when the API reports a transient error
+MODEL_CALL_ATTEMPTS = 3
+
+# Paces model calls (retries included) to the per-minute quota so bursts wait
+# briefly here instead of being rejected with ResourceExhausted
+_GEMINI_LIMITER = TokenBucket(rpm=GEMINI_RPM)
+
+# Consecutive failed calls after which a model is skipped, and for how long
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+# Sampling settings; low temperatures keep parses deterministic and
+# rankings consistent
+_PARSE_GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "top_p": 0.95,
+    "top_k": 64,
+}
+_RANK_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.95,
+    "top_k": 64,
+}
+
+# Shape of a ranking response: rank items ordered from best to worst match
+_RANK_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "score": {"type": "integer"},
+            "reason": {"type": "string"},
+        },
+        "required": ["id", "score", "reason"],
+    },
+}
+
+# Shape of a query parse. Gemini's schemas can't express an object with free
+# keys, so "features" comes back as name/value pairs; _ensure_complete_structure
+# turns them into the dict the prompt describes
+_QUERY_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "product_category": {"type": "string"},
+        "product_type": {"type": "string"},
+        "features": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "value": {"type": "string"},
+                },
+                "required": ["name", "value"],
+            },
+        },
+        "brands": {"type": "array", "items": {"type": "string"}},
+        "budget": {"type": "number"},
+        "condition": {"type": "string"},
+        "keywords": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["product_category", "product_type", "keywords"],
+}
+
+# Static parts of the parse_user_query prompt; the query and budget go in between
+_PARSE_QUERY_PROMPT_HEAD = """
+Parse this user query for tech products and extract structured information:
+
+Query: \""""
+_PARSE_QUERY_PROMPT_TAIL = """
+
+Return ONLY a JSON object with these fields:
+- product_category: general category (e.g., laptop, phone, gaming)
+- product_type: specific type (e.g., gaming laptop, smartphone)
+- features: dict of important features mentioned (e.g., RAM, processor)
+- brands: array of preferred brands mentioned (e.g., ["Apple", "Samsung"])
+- budget: maximum price (use value from input, or extract from query)
+- condition: preferred condition if mentioned (new, used, refurbished, any)
+- keywords: array of important keywords for searching (combine product type with key features)
+
+DO NOT include any explanations, just the JSON object.
+
+Example:
+{
+    "product_category": "laptop",
+    "product_type": "gaming laptop",
+    "features": {
+        "graphics": "RTX 3060",
+        "processor": "i7",
+        "ram": "16GB",
+        "storage": "1TB SSD"
+    },
+    "brands": ["ASUS", "MSI", "Lenovo"],
+    "budget": 1200,
+    "condition": "new",
+    "keywords": ["gaming laptop", "RTX 3060", "i7", "16GB"]
+}
+"""
+
+# Ranking prompt; only the preferences and the product table vary. Everything
+# shared by a ranking's batches comes before the products, so each batch's
+# prompt starts with the same prefix and can hit Gemini's context caching
+_RANK_PROMPT_TEMPLATE = """
+Rank the products listed at the end based on the user preferences.
+
+User preferences: {preferences}
+
+Return ONLY a JSON array of objects with format:
+[
+    {{"id": 0, "score": 95, "reason": "Short reason"}},
+    {{"id": 2, "score": 80, "reason": "Short reason"}},
+    ...
+]
+
+Ranked from best to worst match. The "id" must match the id from the input list.
+
+Products (one per line, fields separated by "|"):
+{products}
+"""
+
+# Number of products sent to the model in each ranking request
+RANKING_BATCH_SIZE = 25
+
+# At most this many products are sent to the model per ranking; the rest are
+# appended after the ranked ones, cheapest first
+RANKING_MAX_CANDIDATES = 50
+
+# Products priced above budget times this factor aren't sent to the model
+RANKING_BUDGET_SLACK = 1.2
+
+# Product titles are cut to this length in ranking prompts to bound token use
+RANKING_TITLE_MAX_CHARS = 120
+
+# Lists of at most this many products are ranked locally instead of by the model
+RANKING_LOCAL_MAX_PRODUCTS = 3
+
+# Product lists ranked at the same time by rank_recommendations_batch
+RANKING_JOB_CONCURRENCY = 4
+
+# Column header of the product table in ranking prompts
+_RANKING_TABLE_HEADER = "id|title|price|condition"
+
+# Body of a markdown code block, optionally tagged as json
+_JSON_CODE_BLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)```')
+
+# Patterns tried in order to pull rank items out of a ranking response
+_RANKING_JSON_RES = (
+    re.compile(r'\[\s*\{.*?\}\s*\]', re.DOTALL),  # Standard JSON array
+    re.compile(r'\[\s*\{(?:"id"|\'id\').*?\}\s*\]', re.DOTALL),  # JSON array starting with id field
+    re.compile(r'\{(?:"id"|\'id\').*?\}', re.DOTALL),  # Single JSON object with id field
+)
+
+# Fields every parsed query has, with their defaults. Immutable defaults are
+# shared; containers are created fresh for each result that lacks them
+_QUERY_FIELD_DEFAULTS = (
+    ("product_category", ""),
+    ("product_type", ""),
+    ("condition", "any"),
+)
+_QUERY_CONTAINER_FIELDS = (
+    ("features", dict),
+    ("attributes", dict), # Added for compatibility with tests
+    ("brands", list),
+    ("keywords", list),
+)
+
+# Common tech terms by product category, used when AI parsing fails;
+# earlier categories take precedence
+_TECH_CATEGORIES = {
+    "laptop": ["laptop", "notebook", "macbook", "chromebook"],
+    "phone": ["phone", "smartphone", "iphone", "android"],
+    "tablet": ["tablet", "ipad", "galaxy tab", "surface"],
+    "desktop": ["desktop", "pc", "computer", "tower"],
+    "gaming": ["gaming", "game", "xbox", "playstation", "ps5", "nintendo"],
+    "audio": ["headphone", "speaker", "earbuds", "airpods", "sound"],
+    "camera": ["camera", "dslr", "mirrorless", "gopro"],
+    "wearable": ["watch", "smartwatch", "fitbit", "garmin", "wear"]
+}
+_TECH_TERM_CATEGORY = {term: category for category, terms in _TECH_CATEGORIES.items() for term in terms}
+_TECH_TERM_RANK = {
+    term: (category_rank, term_rank)
+    for category_rank, terms in enumerate(_TECH_CATEGORIES.values())
+    for term_rank, term in enumerate(terms)
+}
+# Longest terms first so e.g. "headphone" is matched whole rather than as "phone"
+_TECH_TERM_RE = re.compile("|".join(map(re.escape, sorted(_TECH_TERM_CATEGORY, key=len, reverse=True))))
+
+# Maximum number of distinct (query, budget) pairs kept by the parse cache
+QUERY_CACHE_SIZE = 1024
+
+# Successful parses and their query terms keyed on (query_text, budget),
+# least recently used first. Shared by the sync and async parsers; guarded by
+# _QUERY_CACHE_LOCK since Streamlit serves sessions from several threads
+_QUERY_CACHE = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+_query_cache_stats = {"hits": 0, "misses": 0}
+
+QueryCacheInfo = namedtuple("QueryCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Words that don't change what a query is asking for. Price-intent words
+# ("under", "around", "cheap", ...) are kept: they change the parsed price range
+_QUERY_STOPWORDS = frozenset({
+    "a", "an", "the", "and", "or", "for", "with", "in", "of", "to", "on",
+    "i", "me", "my", "im", "need", "want", "looking", "find", "get", "buy",
+    "good", "some", "any", "please",
+})
+
+_QUERY_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+@functools.lru_cache(maxsize=None)
+def _genai():
+    """
+    Import and configure the Gemini SDK on first use
+    
+    The SDK takes most of a second to import, so it is only loaded once a
+    model is needed rather than whenever this module is imported.
+    """
+    import google.generativeai as genai
+    
+    # Configure the Gemini API with the API key
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    
+    # Ask for JSON mode on SDK versions whose GenerationConfig supports it, so
+    # responses come back as bare JSON rather than prose, held to each call's
+    # schema where that is supported too
+    config_fields = getattr(genai.types.GenerationConfig, "__dataclass_fields__", {})
+    if "response_mime_type" in config_fields:
+        _PARSE_GENERATION_CONFIG["response_mime_type"] = "application/json"
+        _RANK_GENERATION_CONFIG["response_mime_type"] = "application/json"
+        if "response_schema" in config_fields:
+            _PARSE_GENERATION_CONFIG["response_schema"] = _QUERY_RESPONSE_SCHEMA
+            _RANK_GENERATION_CONFIG["response_schema"] = _RANK_RESPONSE_SCHEMA
+    return genai
+
+def __getattr__(name):
+    """Expose the lazily imported SDK as utils.ai_helper.genai"""
+    if name == "genai":
+        return _genai()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _json_loads(text):
+    """Parse JSON text, using orjson when available (raises json.JSONDecodeError on bad input)"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def _json_dumps(data):
+    """Serialize data to a JSON string, using orjson when it can handle the data"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode()
+        except TypeError:
+            # e.g. non-string dict keys, which the standard library coerces
+            pass
+    return json.dumps(data)
+
 def parse_user_query(query_text, budget=None):
     """
     Parse user query for tech products using Gemini API
     
+    Successful parses are memoized per (query_text, budget). Fallback
+    structures are not cached, so a failed API call is retried next time.
+    
     Args:
         query_text: User's natural language query
         budget: Optional budget constraint
@@ -23,41 +298,107 @@ def parse_user_query(query_text, budget=None):
     Returns:
         dict: Structured data extracted from the query
     """
-    try:
-        # Build a prompt for structured data extraction
-        prompt = f"""
-        Parse this user query for tech products and extract structured information:
-        
-        Query: "{query_text}"
-        Budget: ${budget if budget else 'Not specified'}
-        
-        Return ONLY a JSON object with these fields:
-        - product_category: general category (e.g., laptop, phone, gaming)
-        - product_type: specific type (e.g., gaming laptop, smartphone)
-        - features: dict of important features mentioned (e.g., RAM, processor)
-        - brands: array of preferred brands mentioned (e.g., ["Apple", "Samsung"])
-        - budget: maximum price (use value from input, or extract from query)
-        - condition: preferred condition if mentioned (new, used, refurbished, any)
-        - keywords: array of important keywords for searching (combine product type with key features)
-        
-        DO NOT include any explanations, just the JSON object.
+    # On the shared SDK loop; a new loop per call (asyncio.run) would leave the
+    # SDK's client on a closed loop after the first call
+    return _run_sync(parse_user_query_async(query_text, budget))
+
+def _query_terms(query_text):
+    """
+    The meaningful words of a query, used to match reworded queries
+    
+    Two queries with the same terms differ only in word order, repetition
+    or stopwords. Any other difference, such as a brand ("asus" vs "msi"),
+    model ("air" vs "pro"), number or price word ("under" vs "around"),
+    makes them different requests.
+    """
+    return frozenset(
+        token for token in _QUERY_TOKEN_RE.findall(query_text.lower())
+        if token not in _QUERY_STOPWORDS
+    )
+
+def _query_cache_get(key):
+    """
+    Return a copy of a cached parse, or None on a miss
+    
+    Tries the exact (query_text, budget) key first, then the most recently
+    used entry with the same budget and the same query terms.
+    """
+    query_text, budget = key
+    with _QUERY_CACHE_LOCK:
+        entry = _QUERY_CACHE.get(key)
+        if entry is None:
+            terms = _query_terms(query_text)
+            for cached_key in reversed(_QUERY_CACHE):
+                if cached_key[1] == budget and _QUERY_CACHE[cached_key][1] == terms:
+                    key, entry = cached_key, _QUERY_CACHE[cached_key]
+                    break
+        if entry is None:
+            _query_cache_stats["misses"] += 1
+            return None
+        _QUERY_CACHE.move_to_end(key)
+        _query_cache_stats["hits"] += 1
+    
+    # Hand out a copy so callers can't modify the cached entry
+    result = copy.deepcopy(entry[0])
+    result["query_text"] = query_text
+    return result
+
+def _query_cache_put(key, result):
+    """Store a copy of a successful parse, evicting the least recently used entry"""
+    with _QUERY_CACHE_LOCK:
+        _QUERY_CACHE[key] = (copy.deepcopy(result), _query_terms(key[0]))
+        _QUERY_CACHE.move_to_end(key)
+        if len(_QUERY_CACHE) > QUERY_CACHE_SIZE:
+            _QUERY_CACHE.popitem(last=False)
+
+def _query_cache_clear():
+    """Empty the parse cache and reset its statistics"""
+    with _QUERY_CACHE_LOCK:
+        _QUERY_CACHE.clear()
+        _query_cache_stats["hits"] = _query_cache_stats["misses"] = 0
+
+def _query_cache_info():
+    """Report parse cache hits, misses, maximum size and current size"""
+    with _QUERY_CACHE_LOCK:
+        return QueryCacheInfo(_query_cache_stats["hits"], _query_cache_stats["misses"], QUERY_CACHE_SIZE, len(_QUERY_CACHE))
+
+parse_user_query.cache_clear = _query_cache_clear
+parse_user_query.cache_info = _query_cache_info
+
+async def parse_user_query_async(query_text, budget=None):
+    """
+    Parse user query for tech products using Gemini's native async API
+    
+    Awaiting this lets an async caller run other work, such as product
+    searches, while the model responds. Shares parse_user_query's cache.
+    
+    Args:
+        query_text: User's natural language query
+        budget: Optional budget constraint
         
-        Example:
-        {{
-            "product_category": "laptop",
-            "product_type": "gaming laptop",
-            "features": {{
-                "graphics": "RTX 3060",
-                "processor": "i7",
-                "ram": "16GB",
-                "storage": "1TB SSD"
-            }},
-            "brands": ["ASUS", "MSI", "Lenovo"],
-            "budget": 1200,
-            "condition": "new",
-            "keywords": ["gaming laptop", "RTX 3060", "i7", "16GB"]
-        }}
-        """
+    Returns:
+        dict: Structured data extracted from the query
+    """
+    key = (query_text, budget)
+    cached = _query_cache_get(key)
+    if cached is not None:
+        return cached
+    
+    result = await _parse_user_query_async(query_text, budget)
+    if result.get("success"):
+        _query_cache_put(key, result)
+    return result
+
+async def _parse_user_query_async(query_text, budget):
+    """Query the Gemini models and parse the response, without caching"""
+    try:
+        # Build a prompt for structured data extraction; only the query and
+        # budget vary, the instructions are shared module constants
+        prompt = (
+            _PARSE_QUERY_PROMPT_HEAD + query_text
+            + '"\nBudget: $' + str(budget if budget else 'Not specified')
+            + _PARSE_QUERY_PROMPT_TAIL
+        )
         
         logger.info(f"Using Gemini model: {GEMINI_MODEL}")
         
@@ -65,16 +406,7 @@ def parse_user_query(query_text, budget=None):
         
         # Try with the primary model first
         try:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            generation_config = {
-                "temperature": 0.1,  # Lower temperature for more deterministic outputs
-                "top_p": 0.95,
-                "top_k": 64,
-            }
-            response = model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
+            response = await _call_model(GEMINI_MODEL, prompt, _PARSE_GENERATION_CONFIG)
             response_text = response.text
             
         except Exception as model_error:
@@ -83,16 +415,7 @@ def parse_user_query(query_text, budget=None):
             # Try fallback model
             try:
                 logger.info(f"Trying fallback model: {FALLBACK_MODEL}")
-                model = genai.GenerativeModel(FALLBACK_MODEL)
-                generation_config = {
-                    "temperature": 0.1,
-                    "top_p": 0.95,
-                    "top_k": 64,
-                }
-                response = model.generate_content(
-                    prompt,
-                    generation_config=generation_config
-                )
+                response = await _call_model(FALLBACK_MODEL, prompt, _PARSE_GENERATION_CONFIG)
                 response_text = response.text
                 
             except Exception as fallback_error:
@@ -107,6 +430,150 @@ def parse_user_query(query_text, budget=None):
         logger.error(f"Error in parse_user_query: {e}")
         return _create_fallback_query_structure(query_text, budget)
 
+@functools.lru_cache(maxsize=None)
+def _get_model(model_name):
+    """Create the GenerativeModel for a model name once and reuse it for every call"""
+    return _genai().GenerativeModel(model_name)
+
+# Event loop that every Gemini SDK call runs on, started on first use. The SDK
+# keeps one grpc.aio client per process, bound to the loop of its first call;
+# once that loop closes (as asyncio.run's do) every later call fails with
+# "Event loop is closed". This loop lives as long as the process instead
+_SDK_LOOP = None
+_SDK_LOOP_LOCK = threading.Lock()
+
+def _sdk_loop():
+    """Return the SDK event loop, starting it on a daemon thread the first time"""
+    global _SDK_LOOP
+    with _SDK_LOOP_LOCK:
+        if _SDK_LOOP is None:
+            _SDK_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_SDK_LOOP.run_forever, name="gemini-sdk-loop", daemon=True).start()
+        return _SDK_LOOP
+
+def _run_sync(coro):
+    """Run a coroutine on the SDK loop and block until it finishes"""
+    return asyncio.run_coroutine_threadsafe(coro, _sdk_loop()).result()
+
+async def _on_sdk_loop(coro):
+    """Await a coroutine on the SDK loop from whichever loop the caller is on"""
+    loop = _sdk_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open"""
+
+class _CircuitBreaker:
+    """
+    Stops calling a failing model for a while instead of waiting on it every time
+    
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive failed calls. While open,
+    calls are refused until BREAKER_RESET_SECONDS have passed; then a single
+    probe call is let through (half-open). A success closes the breaker, a
+    failure opens it again.
+    """
+    
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """Check whether a call may go ahead, claiming the probe if one is due"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < BREAKER_RESET_SECONDS:
+                return False
+            self.probing = True
+            return True
+    
+    def record_success(self):
+        """Close the breaker after a successful call"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+    
+    def record_failure(self):
+        """Count a failed call, opening the breaker at the threshold or on a failed probe"""
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= BREAKER_FAILURE_THRESHOLD:
+                self.opened_at = time.monotonic()
+            self.probing = False
+    
+    def release_probe(self):
+        """Give up a claimed probe without an outcome, so a later call can probe instead"""
+        with self._lock:
+            self.probing = False
+
+# One circuit breaker per model name
+_BREAKERS = {GEMINI_MODEL: _CircuitBreaker(), FALLBACK_MODEL: _CircuitBreaker()}
+
+async def _call_model(model_name, prompt, generation_config=None):
+    """
+    Call a model through its circuit breaker
+    
+    Raises:
+        CircuitOpenError: If the model has been failing and is being skipped;
+            callers treat this like any other model error and fall back
+    """
+    breaker = _BREAKERS[model_name]
+    if not breaker.allow():
+        raise CircuitOpenError(f"{model_name} is failing; skipping it for now")
+    
+    try:
+        response = await _generate_streamed(_get_model(model_name), prompt, generation_config)
+    except Exception:
+        breaker.record_failure()
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        # A cancelled call (e.g. interrupted by a Streamlit rerun) records no
+        # outcome; without this its probe would stay claimed and the breaker
+        # could never close
+        breaker.release_probe()
+    return response
+
+@retry(
+    retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+    wait=wait_random_exponential(multiplier=0.5, max=4),
+    stop=stop_after_attempt(MODEL_CALL_ATTEMPTS),
+    reraise=True
+)
+async def _generate_streamed(model, prompt, generation_config=None):
+    """
+    Request a streamed model response and read it as it arrives
+    
+    Chunks are received while the model is still generating instead of in
+    one body at the end. Once the stream is exhausted the SDK has assembled
+    the chunks, so the returned response's text holds the full output.
+    
+    Quota and availability errors are retried with exponential backoff, so
+    a transient failure doesn't send the request to the fallback model; the
+    last error is re-raised once MODEL_CALL_ATTEMPTS are used up. Each wait
+    is drawn at random up to the backoff (full jitter), so concurrent calls
+    that failed together don't all retry at the same moment.
+    """
+    await _GEMINI_LIMITER.acquire_async()
+    return await _on_sdk_loop(_read_stream(model, prompt, generation_config))
+
+async def _read_stream(model, prompt, generation_config):
+    """Request a streamed response and read it to the end; runs on the SDK loop"""
+    response = await model.generate_content_async(
+        prompt,
+        generation_config=generation_config,
+        stream=True
+    )
+    async for _ in response:
+        pass
+    return response
+
 def _parse_ai_response(response_text, original_query, budget):
     """Parse the AI response and handle various JSON formats and errors"""
     if not response_text:
@@ -138,18 +605,21 @@ def _parse_ai_response(response_text, original_query, budget):
 
 def _extract_json_from_text(text):
     """Extract JSON content from text that might contain other elements"""
-    # Look for content between curly braces
-    import re
-    json_pattern = r'\{[\s\S]*\}'
-    matches = re.findall(json_pattern, text)
-    
-    if matches:
-        # Get the longest match as it's likely the full JSON
-        json_str = max(matches, key=len)
-        
+    # A bare object, as JSON mode returns, parses without scanning for one
+    if text.lstrip().startswith('{'):
+        try:
+            parsed = _json_loads(text)
+        except json.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict):
+            return parsed
+    
+    json_str = _find_json_span(text)
+    
+    if json_str is not None:
         # Parse the JSON string into a dictionary
         try:
-            return json.loads(json_str)
+            return _json_loads(json_str)
         except json.JSONDecodeError:
             logger.error(f"Failed to parse JSON: {json_str}")
             return {}
@@ -157,56 +627,106 @@ def _extract_json_from_text(text):
     # If no matches with curly braces, return empty dict
     return {}
 
+def _find_json_span(text):
+    """
+    Find the first balanced {...} object in text
+    
+    A single scan from the first "{" that tracks brace depth, ignoring braces
+    inside string literals, so trailing prose containing braces is not pulled
+    into the object.
+    
+    Returns:
+        str: The object's text, or None if there is no balanced object
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    
+    depth = 0
+    in_string = False
+    escaped = False
+    for end in range(start, len(text)):
+        char = text[end]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:end + 1]
+    return None
+
 def _ensure_complete_structure(parsed_data, original_query, budget):
     """Ensure all required fields are present in the parsed data"""
-    # Define default structure
-    default_structure = {
-        "product_category": "",
-        "product_type": "",
-        "features": {},
-        "attributes": {}, # Added for compatibility with tests
-        "brands": [],
-        "budget": budget if budget else 0,
-        "condition": "any",
-        "keywords": [],
-        "query_text": original_query, # Added for compatibility with tests
-        "price_range": {"min": 0, "max": budget if budget else 0} # Added for compatibility with tests
-    }
+    # Drop None values from the model so they count as missing; this is a
+    # new dict, so the defaults below are filled in without touching the input
+    parsed_data = {k: v for k, v in parsed_data.items() if v is not None}
+    
+    # Fill in missing fields, creating defaults only for the fields left out
+    for field, default in _QUERY_FIELD_DEFAULTS:
+        if field not in parsed_data:
+            parsed_data[field] = default
+    for field, empty in _QUERY_CONTAINER_FIELDS:
+        if field not in parsed_data:
+            parsed_data[field] = empty()
     
-    # Fill in any missing fields with defaults
-    for key, default_value in default_structure.items():
-        if key not in parsed_data or parsed_data[key] is None:
-            parsed_data[key] = default_value
+    # Features held to _QUERY_RESPONSE_SCHEMA arrive as name/value pairs
+    features = parsed_data["features"]
+    if isinstance(features, list):
+        parsed_data["features"] = {
+            item["name"]: item["value"]
+            for item in features if isinstance(item, dict) and "name" in item
+        }
+    
+    budget_value = budget if budget else 0
+    parsed_data.setdefault("budget", budget_value)
+    parsed_data.setdefault("query_text", original_query) # Added for compatibility with tests
+    
+    # Added for compatibility with tests; fill in whichever price bound a
+    # partial price range left out
+    price_range = parsed_data.get("price_range")
+    if price_range is None:
+        parsed_data["price_range"] = {"min": 0, "max": budget_value}
+    elif isinstance(price_range, dict):
+        parsed_data["price_range"] = {"min": 0, "max": budget_value} | price_range
     
     # If keywords is empty, populate with product type and original query words
     if not parsed_data["keywords"]:
-        words = [w for w in original_query.split() if len(w) > 3]
+        keywords = _query_keywords(original_query)
         if parsed_data["product_type"]:
-            words.append(parsed_data["product_type"])
-        parsed_data["keywords"] = list(set(words))
+            keywords.setdefault(parsed_data["product_type"].lower())
+        parsed_data["keywords"] = list(keywords)
     
     return parsed_data
 
+def _query_keywords(query_text):
+    """
+    Get the distinct lowercased words longer than 3 characters from a query
+    
+    Returns:
+        dict: Keywords as keys in query order, so the result is deduplicated
+        yet stable between runs (unlike a set)
+    """
+    return dict.fromkeys(word.lower() for word in query_text.split() if len(word) > 3)
+
 def _create_fallback_query_structure(query_text, budget):
     """Create a basic query structure when AI parsing fails"""
     logger.info("Using fallback query structure")
     
     # Split query into words and use words longer than 3 chars as keywords
-    keywords = [word for word in query_text.split() if len(word) > 3]
+    keywords = list(_query_keywords(query_text))
     
     # Try to identify product category from common tech terms
     product_category = ""
     product_type = ""
-    tech_categories = {
-        "laptop": ["laptop", "notebook", "macbook", "chromebook"],
-        "phone": ["phone", "smartphone", "iphone", "android"],
-        "tablet": ["tablet", "ipad", "galaxy tab", "surface"],
-        "desktop": ["desktop", "pc", "computer", "tower"],
-        "gaming": ["gaming", "game", "xbox", "playstation", "ps5", "nintendo"],
-        "audio": ["headphone", "speaker", "earbuds", "airpods", "sound"],
-        "camera": ["camera", "dslr", "mirrorless", "gopro"],
-        "wearable": ["watch", "smartwatch", "fitbit", "garmin", "wear"]
-    }
     
     query_lower = query_text.lower()
     
@@ -217,15 +737,12 @@ def _create_fallback_query_structure(query_text, budget):
     if "gaming" in query_lower:
         attributes["gaming"] = "yes"
     
-    for category, terms in tech_categories.items():
-        if any(term in query_lower for term in terms):
-            product_category = category
-            # Use the matched term as the product type
-            for term in terms:
-                if term in query_lower:
-                    product_type = term
-                    break
-            break
+    # Find every tech term in one pass; the earliest category wins, and the
+    # matched term listed first in it becomes the product type
+    matched_terms = {match.group() for match in _TECH_TERM_RE.finditer(query_lower)}
+    if matched_terms:
+        product_type = min(matched_terms, key=_TECH_TERM_RANK.__getitem__)
+        product_category = _TECH_TERM_CATEGORY[product_type]
     
     # Create a basic structure
     return {
@@ -246,6 +763,31 @@ def rank_recommendations(products, user_preferences, budget=None):
     """
     Rank product recommendations based on user preferences
     
+    Products are split into batches of RANKING_BATCH_SIZE that are ranked
+    concurrently, then merged by score. A batch the models fail to rank is
+    appended after the ranked products, cheapest first. Lists of at most
+    RANKING_LOCAL_MAX_PRODUCTS, or preferences from a fallback parse, are
+    ranked locally without calling the model.
+    
+    Args:
+        products: List of product dictionaries
+        user_preferences: Structured user preferences
+        budget: Optional budget constraint
+        
+    Returns:
+        list: Ranked list of products
+    """
+    # On the shared SDK loop; a new loop per call (asyncio.run) would leave the
+    # SDK's client on a closed loop after the first call
+    return _run_sync(rank_recommendations_async(products, user_preferences, budget))
+
+async def rank_recommendations_async(products, user_preferences, budget=None):
+    """
+    Rank product recommendations without blocking the caller's event loop
+    
+    Same behaviour as rank_recommendations, for callers already running
+    inside an event loop.
+    
     Args:
         products: List of product dictionaries
         user_preferences: Structured user preferences
@@ -257,165 +799,245 @@ def rank_recommendations(products, user_preferences, budget=None):
     try:
         if len(products) <= 1:
             return products
-            
-        # Convert products to simplified list for AI
-        product_list = []
-        for i, product in enumerate(products):
-            product_list.append({
-                "id": i,
-                "title": product["title"],
-                "price": product.get("price", 0),
-                "condition": product.get("condition", "unknown")
-            })
-            
-        # Build the ranking prompt
-        products_json = json.dumps(product_list)
-        preferences_json = json.dumps(user_preferences)
-        
-        prompt = f"""
-        Rank these products based on the user preferences:
         
-        User preferences: {preferences_json}
+        # A short list, or preferences from a failed parse that hold nothing
+        # but the query's words, isn't worth a model call
+        if len(products) <= RANKING_LOCAL_MAX_PRODUCTS or not user_preferences or user_preferences.get("success") is False:
+            return _local_rank(products, user_preferences or {}, budget)
         
-        Products: {products_json}
+        # Only send the model products that could plausibly match
+        candidates, left_out = _shortlist_candidates(
+            products,
+            user_preferences.get("keywords") or [],
+            budget or user_preferences.get("budget")
+        )
+        candidate_ids = set(candidates)
         
-        Return ONLY a JSON array of objects with format: 
-        [
-            {{"id": 0, "score": 95, "reason": "Short reason"}},
-            {{"id": 2, "score": 80, "reason": "Short reason"}},
-            ...
+        preferences_json = _json_dumps(user_preferences)
+        batches = [
+            candidates[start:start + RANKING_BATCH_SIZE]
+            for start in range(0, len(candidates), RANKING_BATCH_SIZE)
         ]
         
-        Ranked from best to worst match. The "id" must match the id from the input list.
-        """
+        logger.info(f"Using Gemini model for ranking: {GEMINI_MODEL} ({len(candidates)} of {len(products)} products, {len(batches)} batch(es))")
+        batch_rankings = await _rank_batches(products, batches, preferences_json)
         
-        print(f"Using Gemini model for ranking: {GEMINI_MODEL}")
+        # Collect scores by product id; products the models didn't rank are kept aside
+        ranked_items = {}
+        for ranking in batch_rankings:
+            for rank_item in ranking:
+                product_id = rank_item.get("id")
+                if isinstance(product_id, int) and product_id in candidate_ids and product_id not in ranked_items:
+                    ranked_items[product_id] = rank_item
         
-        # Try with primary model
-        try:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            # Add appropriate generation config without response_mime_type
-            generation_config = {
-                "temperature": 0.2,  # Lower temperature for consistent rankings
-                "top_p": 0.95,
-                "top_k": 64,
-            }
-            response = model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-            
-            # Parse the ranked result
-            try:
-                # First, clean the response text - remove markdown code blocks if present
-                cleaned_text = response.text
-                if "```json" in cleaned_text:
-                    # Extract just the JSON part from code blocks
-                    import re
-                    json_block_pattern = r'```(?:json)?\s*([\s\S]*?)```'
-                    matches = re.findall(json_block_pattern, cleaned_text)
-                    if matches:
-                        cleaned_text = matches[0].strip()
-                
-                # Try to parse the JSON
-                ranked_products = json.loads(cleaned_text)
-                
-                # Reorder the original product list
-                reordered_products = []
-                for rank_item in ranked_products:
-                    product_id = rank_item["id"]
-                    if 0 <= product_id < len(products):
-                        # Add the ranking reason to the product for display
-                        products[product_id]["rank_reason"] = rank_item.get("reason", "")
-                        products[product_id]["rank_score"] = rank_item.get("score", 0)
-                        reordered_products.append(products[product_id])
-                
-                # If we missed any products, add them at the end
-                for i, product in enumerate(products):
-                    if not any(rank_item.get("id", -1) == i for rank_item in ranked_products):
-                        reordered_products.append(product)
-                
-                return reordered_products
-            except json.JSONDecodeError:
-                print(f"Failed to parse ranking result: {response.text}")
-                # Extract JSON array if possible using a more robust pattern
-                import re
-                # Try different patterns to extract JSON
-                json_patterns = [
-                    r'\[\s*\{.*?\}\s*\]',  # Standard JSON array
-                    r'\[\s*\{(?:"id"|\'id\').*?\}\s*\]',  # JSON array starting with id field
-                    r'\{(?:"id"|\'id\').*?\}',  # Single JSON object with id field
-                ]
-                
-                for pattern in json_patterns:
-                    matches = re.findall(pattern, response.text, re.DOTALL)
-                    if matches:
-                        for match in matches:
-                            try:
-                                # Clean up the match
-                                clean_match = match.strip()
-                                # Try to parse the JSON
-                                ranked_products = json.loads(clean_match)
-                                if isinstance(ranked_products, dict):
-                                    # If it's a single object, convert to list
-                                    ranked_products = [ranked_products]
-                                
-                                # Process as above
-                                reordered_products = []
-                                for rank_item in ranked_products:
-                                    product_id = rank_item.get("id")
-                                    if product_id is not None and 0 <= product_id < len(products):
-                                        products[product_id]["rank_reason"] = rank_item.get("reason", "")
-                                        products[product_id]["rank_score"] = rank_item.get("score", 0)
-                                        reordered_products.append(products[product_id])
-                                        
-                                # Add missing products
-                                for i, product in enumerate(products):
-                                    if not any(rank_item.get("id", -1) == i for rank_item in ranked_products):
-                                        reordered_products.append(product)
-                                        
-                                return reordered_products
-                            except json.JSONDecodeError:
-                                continue
-                
-                # If we couldn't parse the JSON with regex, just sort by price as fallback
-                print("Couldn't extract valid JSON. Falling back to price-based sorting")
-                sorted_products = sorted(products, key=lambda x: x.get('price', 9999))
-                return sorted_products
-                
-        except Exception as model_error:
-            print(f"Error ranking with {GEMINI_MODEL}: {model_error}")
-            
-            # Try fallback model
-            try:
-                print(f"Trying fallback model for ranking: {FALLBACK_MODEL}")
-                model = genai.GenerativeModel(FALLBACK_MODEL)
-                response = model.generate_content(prompt)
-                
-                # Process response
-                ranked_products = json.loads(response.text)
-                
-                # Reorder products
-                reordered_products = []
-                for rank_item in ranked_products:
-                    product_id = rank_item["id"]
-                    if 0 <= product_id < len(products):
-                        products[product_id]["rank_reason"] = rank_item.get("reason", "")
-                        products[product_id]["rank_score"] = rank_item.get("score", 0)
-                        reordered_products.append(products[product_id])
-                
-                # Add missing products
-                for i, product in enumerate(products):
-                    if not any(rank_item.get("id", -1) == i for rank_item in ranked_products):
-                        reordered_products.append(product)
-                
-                return reordered_products
-            except Exception as fallback_error:
-                print(f"Error with fallback ranking model: {fallback_error}")
-                raise fallback_error
+        reordered_products = []
+        for product_id, rank_item in sorted(ranked_items.items(), key=lambda item: -(item[1].get("score") or 0)):
+            # Add the ranking reason to the product for display
+            products[product_id]["rank_reason"] = rank_item.get("reason", "")
+            products[product_id]["rank_score"] = rank_item.get("score", 0)
+            reordered_products.append(products[product_id])
+        
+        # If we missed any products, add them at the end sorted by price,
+        # followed by the ones the shortlist left out
+        unranked_products = [products[i] for i in candidates if i not in ranked_items]
+        reordered_products.extend(sorted(unranked_products, key=lambda x: x.get("price", 9999)))
+        reordered_products.extend(sorted((products[i] for i in left_out), key=lambda x: x.get("price", 9999)))
+        
+        return reordered_products
                 
     except Exception as e:
-        print(f"Error ranking products: {e}")
-        # Sort by price as fallback
-        sorted_products = sorted(products, key=lambda x: x.get("price", 9999))
-        return sorted_products 
\ No newline at end of file
+        logger.error(f"Error ranking products: {e}")
+        # Rank locally as fallback
+        return _local_rank(products, user_preferences or {}, budget)
+
+def _local_rank(products, user_preferences, budget=None):
+    """
+    Rank products without the model
+    
+    Orders by the number of keywords in the title, then by whether the price
+    is within budget and the condition is the preferred one, then cheapest
+    first. No rank_score is set; that is reserved for model rankings.
+    
+    Args:
+        products: List of product dictionaries
+        user_preferences: Structured user preferences (may be empty)
+        budget: Optional budget constraint
+        
+    Returns:
+        list: Ranked list of products
+    """
+    keywords = [str(keyword).lower() for keyword in user_preferences.get("keywords") or [] if keyword]
+    budget = budget or user_preferences.get("budget")
+    condition = str(user_preferences.get("condition") or "any").lower()
+    
+    def sort_key(product):
+        price = product.get("price")
+        if price is None:
+            price = 9999
+        title = str(product.get("title", "")).lower()
+        return (
+            -sum(keyword in title for keyword in keywords),
+            bool(budget) and price > budget,
+            condition != "any" and str(product.get("condition", "")).lower() != condition,
+            price
+        )
+    
+    return sorted(products, key=sort_key)
+
+async def rank_recommendations_batch(jobs, concurrency=RANKING_JOB_CONCURRENCY):
+    """
+    Rank several separate product lists concurrently
+    
+    Each job is ranked as by rank_recommendations_async, with at most
+    `concurrency` jobs in flight at once; their model calls still share the
+    Gemini rate limiter, so a large batch waits for quota instead of being
+    rejected.
+    
+    Args:
+        jobs: Iterable of (products, user_preferences) or
+            (products, user_preferences, budget) tuples
+        concurrency: Maximum number of jobs ranked at the same time
+    
+    Returns:
+        list: Ranked product list for each job, in the order of `jobs`
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def rank_one(products, user_preferences, budget=None):
+        async with semaphore:
+            return await rank_recommendations_async(products, user_preferences, budget)
+    
+    return await asyncio.gather(*(rank_one(*job) for job in jobs))
+
+def _shortlist_candidates(products, keywords, budget):
+    """
+    Pick the products worth sending to the model for ranking
+    
+    Products priced over budget * RANKING_BUDGET_SLACK, or whose title
+    contains none of the keywords, are left out. If more than
+    RANKING_MAX_CANDIDATES remain, those with the most keyword matches
+    (then the cheapest) are kept.
+    
+    Args:
+        products: List of product dictionaries
+        keywords: Search keywords from the parsed query (may be empty)
+        budget: Budget to filter on, or None/0 for no price limit
+        
+    Returns:
+        tuple: (candidate indices in input order, indices left out)
+    """
+    max_price = budget * RANKING_BUDGET_SLACK if budget else None
+    keywords = [keyword.lower() for keyword in keywords if keyword]
+    
+    scored = []
+    left_out = []
+    for i, product in enumerate(products):
+        price = product.get("price")
+        if max_price is not None and price is not None and price > max_price:
+            left_out.append(i)
+            continue
+        
+        matches = 0
+        if keywords:
+            title = str(product.get("title", "")).lower()
+            matches = sum(keyword in title for keyword in keywords)
+            if not matches:
+                left_out.append(i)
+                continue
+        
+        scored.append((-matches, price if price is not None else float("inf"), i))
+    
+    # Over the cap, keep the most keyword matches, then the cheapest
+    scored.sort()
+    left_out.extend(i for _, _, i in scored[RANKING_MAX_CANDIDATES:])
+    return sorted(i for _, _, i in scored[:RANKING_MAX_CANDIDATES]), left_out
+
+async def _rank_batches(products, batches, preferences_json):
+    """Rank every batch of product ids concurrently, one model call per batch"""
+    return await asyncio.gather(*(
+        _rank_batch(products, batch, preferences_json)
+        for batch in batches
+    ))
+
+async def _rank_batch(products, batch, preferences_json):
+    """
+    Rank one batch of products, trying the fallback model if the primary fails
+    
+    Returns:
+        list: Rank items ({"id", "score", "reason"}), or an empty list if
+        neither model produced a usable ranking
+    """
+    # Convert products to a compact table for AI; field names are sent once
+    # in the header instead of repeated for every product
+    rows = [_RANKING_TABLE_HEADER]
+    for i in batch:
+        product = products[i]
+        title = _table_cell(product["title"])[:RANKING_TITLE_MAX_CHARS]
+        rows.append(f"{i}|{title}|{product.get('price', 0)}|{_table_cell(product.get('condition', 'unknown'))}")
+        
+    # Build the ranking prompt
+    products_table = "\n".join(rows)
+    
+    prompt = _RANK_PROMPT_TEMPLATE.format(preferences=preferences_json, products=products_table)
+    
+    # Try with primary model
+    try:
+        response = await _call_model(GEMINI_MODEL, prompt, _RANK_GENERATION_CONFIG)
+        ranking = _parse_ranking_response(response.text)
+        if ranking is not None:
+            return ranking
+        logger.warning("Couldn't extract valid JSON from ranking result")
+    except Exception as model_error:
+        logger.error(f"Error ranking with {GEMINI_MODEL}: {model_error}")
+    
+    # Try fallback model
+    try:
+        logger.info(f"Trying fallback model for ranking: {FALLBACK_MODEL}")
+        response = await _call_model(FALLBACK_MODEL, prompt, _RANK_GENERATION_CONFIG)
+        ranking = _parse_ranking_response(response.text)
+        if ranking is not None:
+            return ranking
+        logger.warning("Couldn't extract valid JSON from fallback ranking result")
+    except Exception as fallback_error:
+        logger.error(f"Error with fallback ranking model: {fallback_error}")
+    
+    return []
+
+def _table_cell(value):
+    """Flatten a value onto one line without "|" so it fits in a ranking table cell"""
+    return " ".join(str(value).split()).replace("|", "/")
+
+def _parse_ranking_response(response_text):
+    """
+    Parse a ranking response into a list of rank items
+    
+    Returns:
+        list: Parsed rank items, or None if no valid JSON could be extracted
+    """
+    # First, clean the response text - remove markdown code blocks if present
+    cleaned_text = response_text
+    if "```json" in cleaned_text:
+        # Extract just the JSON part from the first code block
+        match = _JSON_CODE_BLOCK_RE.search(cleaned_text)
+        if match:
+            cleaned_text = match.group(1).strip()
+    
+    try:
+        ranked_products = _json_loads(cleaned_text)
+        return [ranked_products] if isinstance(ranked_products, dict) else ranked_products
+    except json.JSONDecodeError:
+        # The raw response can be several KB; only format it when debug logging is on
+        logger.opt(lazy=True).debug("Failed to parse ranking result: {}", lambda: response_text)
+    
+    # Extract JSON array if possible using a more robust pattern
+    # Try different patterns to extract JSON
+    for pattern in _RANKING_JSON_RES:
+        for match in pattern.findall(response_text):
+            try:
+                ranked_products = _json_loads(match.strip())
+            except json.JSONDecodeError:
+                continue
+            # If it's a single object, convert to list
+            return [ranked_products] if isinstance(ranked_products, dict) else ranked_products
+    
+    return None
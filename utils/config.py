@@ -1,4 +1,5 @@
 import os
+import random
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -7,6 +8,9 @@ load_dotenv()
 # API Keys
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Gemini requests per minute allowed by the API quota; calls are paced to stay under it
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+
 # Site configurations
 SITES = {
     "ebay": {
@@ -43,7 +47,7 @@ FB_CREDENTIALS = {
 }
 
 # User agent rotation - Updated with more recent browser versions
-USER_AGENTS = [
+USER_AGENTS = (
     # Chrome
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
@@ -59,7 +63,11 @@ USER_AGENTS = [
     # Mobile
     "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
     "Mozilla/5.0 (Linux; Android 14; SM-S908U) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Mobile Safari/537.36"
-]
+)
+
+def pick_user_agent():
+    """Pick a random user agent from USER_AGENTS for the next request"""
+    return random.choice(USER_AGENTS)
 
 # Request settings
 REQUEST_DELAY_MIN = 2  # seconds
@@ -77,6 +85,9 @@ SECURITY = {
     "api_key_encryption": True,
     "session_timeout": 3600,  # 1 hour in seconds
     "max_login_attempts": 5,
+    # Redis URL for rate-limit and login state shared by all workers; kept
+    # in process when unset
+    "state_redis_url": os.getenv("SECURITY_REDIS_URL"),
     "rate_limiting": {
         "enabled": True,
         "max_requests_per_minute": 60
@@ -1,18 +1,53 @@
 import requests
 import json
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
+import functools
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from math import radians, sin, cos, asin, sqrt
+import numpy as np
+
+# Mean Earth radius, for great-circle distances
+EARTH_RADIUS_MILES = 3958.7613
+
+# Maximum number of distinct addresses (or rounded coordinates) kept by each geocoding cache
+LOCATION_CACHE_SIZE = 1024
+
+# Seconds to wait for a Nominatim geocode
+GEOCODER_TIMEOUT = 5
+
+# Seconds an IP-based location is reused before it is looked up again
+USER_LOCATION_TTL = 3600
+
+# Seconds to wait for the IP geolocation service
+IP_LOOKUP_TIMEOUT = 3
+
+# Shared session so lookups reuse one connection; gateway errors are retried
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504))))
+
+# (expiry time, location) of the last successful IP lookup, or None
+_user_location_cache = None
 
 def get_user_location():
     """
     Get the user's location based on IP address
     
+    A successful lookup is reused for USER_LOCATION_TTL seconds, since the
+    process's IP rarely changes. Failed lookups are not cached.
+    
     Returns:
         dict: Location information including city, state, zipcode, lat, lng
     """
+    global _user_location_cache
+    cached = _user_location_cache
+    if cached is not None and time.monotonic() < cached[0]:
+        # Hand out a copy so callers can't modify the cached entry
+        return dict(cached[1])
+    
     try:
         # Use a free IP geolocation service
-        response = requests.get('https://ipinfo.io/json')
+        response = _SESSION.get('https://ipinfo.io/json', timeout=IP_LOOKUP_TIMEOUT)
         data = response.json()
         
         location = {
@@ -28,17 +63,28 @@ def get_user_location():
             lat, lng = location['loc'].split(',')
             location['latitude'] = float(lat)
             location['longitude'] = float(lng)
-            
-        return location
+        
+        _user_location_cache = (time.monotonic() + USER_LOCATION_TTL, location)
+        return dict(location)
         
     except Exception as e:
         print(f"Error getting location: {e}")
         return None
 
+def _user_location_cache_clear():
+    """Forget the cached IP-based location"""
+    global _user_location_cache
+    _user_location_cache = None
+
+get_user_location.cache_clear = _user_location_cache_clear
+
 def get_location_by_address(address):
     """
     Get location information from a specific address or place name
     
+    Results are memoized per address (ignoring extra whitespace), so repeat
+    lookups don't hit Nominatim again. Failed lookups are not cached.
+    
     Args:
         address (str): User-provided address, city name, or place name
         
@@ -46,49 +92,80 @@ def get_location_by_address(address):
         dict: Location information including city, region, country, coordinates, zipcode
     """
     try:
-        geolocator = Nominatim(user_agent="tech_deals_finder")
-        location_data = geolocator.geocode(address, addressdetails=True, language="en")
-        
-        if not location_data:
-            return None
-            
-        raw_address = location_data.raw.get('address', {})
-        
-        location = {
-            'city': raw_address.get('city') or raw_address.get('town') or raw_address.get('village') or raw_address.get('hamlet'),
-            'region': raw_address.get('state'),
-            'country': raw_address.get('country'),
-            'loc': f"{location_data.latitude},{location_data.longitude}",
-            'latitude': location_data.latitude,
-            'longitude': location_data.longitude,
-            'zipcode': raw_address.get('postcode'),
-            'county': raw_address.get('county')
-        }
-        
-        return location
+        location = _geocode_address(" ".join(address.split()))
     except Exception as e:
         print(f"Error getting location from address: {e}")
         return None
+    
+    # Hand out a copy so callers can't modify the cached entry
+    return dict(location) if location else None
+
+@functools.lru_cache(maxsize=None)
+def _get_geocoder():
+    """
+    Create the Nominatim geocoder once and share it between lookups
+    
+    geopy is imported here, on the first geocode, rather than with this module.
+    """
+    from geopy.geocoders import Nominatim
+    return Nominatim(user_agent="tech_deals_finder", timeout=GEOCODER_TIMEOUT)
+
+@functools.lru_cache(maxsize=LOCATION_CACHE_SIZE)
+def _geocode_address(address):
+    """Geocode a normalized address; errors propagate so they are never cached"""
+    location_data = _get_geocoder().geocode(address, addressdetails=True, language="en")
+    
+    if not location_data:
+        return None
+        
+    raw_address = location_data.raw.get('address', {})
+    
+    return {
+        'city': raw_address.get('city') or raw_address.get('town') or raw_address.get('village') or raw_address.get('hamlet'),
+        'region': raw_address.get('state'),
+        'country': raw_address.get('country'),
+        'loc': f"{location_data.latitude},{location_data.longitude}",
+        'latitude': location_data.latitude,
+        'longitude': location_data.longitude,
+        'zipcode': raw_address.get('postcode'),
+        'county': raw_address.get('county')
+    }
+
+get_location_by_address.cache_clear = _geocode_address.cache_clear
+get_location_by_address.cache_info = _geocode_address.cache_info
 
 def get_zipcode_from_coords(latitude, longitude):
-    """Convert coordinates to zipcode using Nominatim (OpenStreetMap)"""
+    """
+    Convert coordinates to zipcode using Nominatim (OpenStreetMap)
+    
+    Coordinates are rounded to 4 decimal places (about 11 m) and lookups are
+    memoized per rounded point, so nearby positions share one reverse geocode.
+    """
     try:
-        geolocator = Nominatim(user_agent="tech_deals_finder")
-        location = geolocator.reverse((latitude, longitude))
-        
-        # Extract postal code
-        address = location.raw.get('address', {})
-        zipcode = address.get('postcode')
-        
-        return zipcode
+        return _reverse_geocode_zipcode(round(latitude, 4), round(longitude, 4))
     except Exception as e:
         print(f"Error getting zipcode: {e}")
         return None
 
+@functools.lru_cache(maxsize=LOCATION_CACHE_SIZE)
+def _reverse_geocode_zipcode(latitude, longitude):
+    """Reverse geocode rounded coordinates; errors propagate so they are never cached"""
+    location = _get_geocoder().reverse((latitude, longitude))
+    
+    # Extract postal code
+    address = location.raw.get('address', {})
+    return address.get('postcode')
+
+get_zipcode_from_coords.cache_clear = _reverse_geocode_zipcode.cache_clear
+get_zipcode_from_coords.cache_info = _reverse_geocode_zipcode.cache_info
+
 def calculate_distance(origin, destination):
     """
     Calculate distance between two geographical points
     
+    Uses the haversine (great-circle) formula, which is within about 0.5% of
+    the ellipsoidal distance and much cheaper to compute.
+    
     Args:
         origin (tuple): (latitude, longitude) of origin point
         destination (tuple): (latitude, longitude) of destination point
@@ -97,10 +174,32 @@ def calculate_distance(origin, destination):
         float: Distance in miles
     """
     try:
-        # geodesic returns distance in kilometers, convert to miles
-        distance_km = geodesic(origin, destination).kilometers
-        distance_miles = distance_km * 0.621371
-        return distance_miles
+        lat1, lon1 = map(radians, origin)
+        lat2, lon2 = map(radians, destination)
+        
+        a = sin((lat2 - lat1) * 0.5) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) * 0.5) ** 2
+        return 2 * EARTH_RADIUS_MILES * asin(sqrt(a))
     except Exception as e:
         print(f"Error calculating distance: {e}")
-        return None 
\ No newline at end of file
+        return None
+
+def calculate_distance_batch(origins, destinations):
+    """
+    Calculate distances between many pairs of points at once
+    
+    Args:
+        origins (array-like): (latitude, longitude) pairs, shape (N, 2), or a
+            single (latitude, longitude) pair to measure every destination from
+        destinations (array-like): (latitude, longitude) pairs, shape (N, 2)
+        
+    Returns:
+        numpy.ndarray: Distances in miles, one per destination
+    """
+    origins = np.radians(np.asarray(origins, dtype=float))
+    destinations = np.radians(np.asarray(destinations, dtype=float))
+    
+    lat1, lon1 = origins[..., 0], origins[..., 1]
+    lat2, lon2 = destinations[..., 0], destinations[..., 1]
+    
+    a = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
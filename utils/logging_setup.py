@@ -42,7 +42,9 @@ def setup_logging():
         diagnose=True    # Include variables in tracebacks
     )
     
-    # Main log file - all levels (default INFO and above)
+    # Main log file - all levels (default INFO and above). Variable dumps and
+    # extended backtraces are left to the error log, which gets every record
+    # that carries a traceback, so the busy sink doesn't build them too
     logger.add(
         "logs/crawler.log",
         format=log_format,
@@ -51,8 +53,8 @@ def setup_logging():
         compression="zip",
         retention=backup_count,
         enqueue=True,
-        backtrace=True,  # Include backtrace for better error reporting
-        diagnose=True    # Include variables in tracebacks
+        backtrace=False,
+        diagnose=False
     )
     
     # Error log file - only ERROR and WARNING levels
@@ -74,6 +76,10 @@ def setup_logging():
     import logging
     
     class InterceptHandler(logging.Handler):
+        # Stack depth of the logging call, per call site; a given call site
+        # always reaches emit through the same logging frames
+        _depth_cache = {}
+        
         def emit(self, record):
             # Get corresponding loguru level if it exists
             try:
@@ -81,11 +87,16 @@ def setup_logging():
             except ValueError:
                 level = record.levelno
             
-            # Find caller from where the logged message originated
-            frame, depth = logging.currentframe(), 2
-            while frame.f_code.co_filename == logging.__file__:
-                frame = frame.f_back
-                depth += 1
+            # Find caller from where the logged message originated, walking
+            # the stack only the first time a call site logs
+            key = (record.pathname, record.lineno)
+            depth = self._depth_cache.get(key)
+            if depth is None:
+                frame, depth = logging.currentframe(), 2
+                while frame.f_code.co_filename == logging.__file__:
+                    frame = frame.f_back
+                    depth += 1
+                self._depth_cache[key] = depth
             
             logger.opt(depth=depth, exception=record.exc_info).log(
                 level, record.getMessage()
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+import time
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for outgoing API calls
+
+    Holds up to `rpm` tokens and refills them continuously at rpm / 60 per
+    second. Each call takes one token; when the bucket is empty the caller
+    waits until its token has been refilled instead of being rejected by the
+    API. Safe to share between threads and event loops.
+    """
+
+    def __init__(self, rpm):
+        """
+        Args:
+            rpm (int): Sustained requests per minute, also the burst size
+        """
+        self.capacity = rpm
+        self.tokens = float(rpm)
+        self.refill_rate = rpm / 60.0
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """
+        Take a token, going into debt if none is left
+
+        Returns:
+            float: Seconds the caller must wait before using its token
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self.last, 0.0)
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.last = max(now, self.last)
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.refill_rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Wait for a token without blocking the event loop"""
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
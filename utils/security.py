@@ -3,38 +3,265 @@ import time
 import hashlib
 import base64
 import hmac
-import secrets
-from datetime import datetime, timedelta
-from cryptography.fernet import Fernet
+import struct
+import tempfile
+import functools
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import padding
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from utils.config import SECURITY
 
+# rfernet (a Rust Fernet implementation) is optional; fall back to
+# cryptography's when it isn't installed. Both follow the Fernet spec, so
+# tokens from either decrypt with the other
+try:
+    import rfernet
+except ImportError:
+    rfernet = None
+
+# redis is optional too; without it (or SECURITY["state_redis_url"]) the
+# rate-limit and login state is kept in process
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Keyed BLAKE2b MACs CSRF tokens in one hash pass where HMAC-SHA256 needs
+# two; Python builds without it (e.g. some FIPS-only ones) fall back to HMAC
+_blake2b = getattr(hashlib, "blake2b", None)
+
+# Escapes applied by sanitize_input, built once for str.translate
+_SANITIZE_TABLE = str.maketrans({
+    "<": "&lt;",
+    ">": "&gt;",
+    "'": "&#39;",
+    '"': "&quot;",
+    ";": "&#59;"
+})
+
+# Layout of a Fernet token before base64: version byte, 8-byte timestamp,
+# 16-byte IV, ciphertext, 32-byte HMAC-SHA256
+_FERNET_VERSION = b"\x80"
+_FERNET_HEADER_SIZE = 1 + 8 + 16
+_FERNET_HMAC_SIZE = 32
+
+# encrypt_bulk output: 12-byte random nonce, then AES-256-GCM ciphertext and tag
+_BULK_NONCE_SIZE = 12
+
+# HKDF contexts for keys derived from the Fernet key; each differs from (and
+# can't reveal) the Fernet key and the others
+_BULK_KEY_INFO = b"deal-finder bulk encryption"
+_CSRF_KEY_INFO = b"deal-finder csrf"
+
+# Rate-limit and login checks between sweeps of idle per-IP / per-user state
+STATE_SWEEP_INTERVAL = 4096
+
+# Locks guarding per-IP / per-user state; a key's lock is picked by its hash,
+# so checks for different IPs rarely wait on each other
+LOCK_STRIPES = 64
+
+# Seconds a user is locked out after too many failed logins
+LOGIN_LOCKOUT_SECONDS = 15 * 60
+
+# Failed login attempts are forgotten after this many seconds without another failure
+FAILED_LOGIN_TTL = 60 * 60
+
+# Prefix for the rate-limit and login keys kept in Redis
+REDIS_KEY_PREFIX = "deal-finder:security:"
+
+# Token bucket for one IP in a Redis hash, refilled on the Redis server's
+# clock so workers on different hosts agree. KEYS: bucket; ARGV: limit per
+# minute. Returns 1 if the request is allowed
+_REDIS_RATE_LIMIT_SCRIPT = """
+local max_requests = tonumber(ARGV[1])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens = tonumber(bucket[1]) or max_requests
+local last = tonumber(bucket[2]) or now
+tokens = math.min(max_requests, tokens + (now - last) * max_requests / 60)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(now))
+redis.call('EXPIRE', KEYS[1], 120)
+return allowed
+"""
+
+# Login check. KEYS: failure count, lockout flag; ARGV: max attempts,
+# lockout seconds. Returns 1 if the login may proceed
+_REDIS_VALIDATE_LOGIN_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if (tonumber(redis.call('GET', KEYS[1])) or 0) >= tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+return 1
+"""
+
+# Failed login. KEYS: failure count, lockout flag; ARGV: failure TTL.
+# Failures during a lockout are dropped, as the lockout resets the count
+_REDIS_RECORD_FAILURE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# Security headers are fixed at import: a read-only view of a copy, so callers
+# can't modify them and later changes to SECURITY["headers"] don't leak in
+_SECURE_HEADERS = MappingProxyType(dict(SECURITY["headers"]))
+
+class _RFernetCipher:
+    """rfernet cipher behind cryptography's Fernet interface (bytes in, bytes out)"""
+    
+    def __init__(self, key):
+        self._fernet = rfernet.Fernet(key.decode())
+    
+    def encrypt(self, data):
+        token = self._fernet.encrypt(data)
+        return token.encode() if isinstance(token, str) else bytes(token)
+    
+    def decrypt(self, token):
+        return bytes(self._fernet.decrypt(token.decode()))
+
+def _passthrough(data):
+    """Stand-in for the encryption methods while encryption is disabled"""
+    return data
+
+# SecurityManager methods replaced by _passthrough when encryption is disabled
+_ENCRYPTION_METHODS = (
+    "encrypt_data", "decrypt_data",
+    "encrypt_data_raw", "decrypt_data_raw",
+    "encrypt_bulk", "decrypt_bulk"
+)
+
+def _redis_from_config():
+    """Redis client for SECURITY["state_redis_url"], or None to keep state in process"""
+    url = SECURITY.get("state_redis_url")
+    if not url or redis is None:
+        return None
+    return redis.Redis.from_url(url)
+
 class SecurityManager:
-    def __init__(self):
-        """Initialize the security manager"""
-        self.request_log = {}
+    def __init__(self, redis_client=None):
+        """
+        Initialize the security manager
+        
+        Args:
+            redis_client: Redis client holding rate-limit and login state, so
+                it is shared by every worker and survives restarts; defaults
+                to one for SECURITY["state_redis_url"], if set
+        """
+        # Ordered least to most recently checked, so sweeps stop at the first
+        # IP still refilling instead of scanning every one
+        self.request_log = OrderedDict()
         self.login_attempts = {}
-        self._initialize_encryption_key()
+        self._sweep_counter = 0
+        self._stripes = tuple(threading.Lock() for _ in range(LOCK_STRIPES))
+        self._redis = redis_client if redis_client is not None else _redis_from_config()
+        if self._redis is not None:
+            # Each check is one atomic EVALSHA round trip
+            self._redis_rate_limit = self._redis.register_script(_REDIS_RATE_LIMIT_SCRIPT)
+            self._redis_validate_login = self._redis.register_script(_REDIS_VALIDATE_LOGIN_SCRIPT)
+            self._redis_record_failure = self._redis.register_script(_REDIS_RECORD_FAILURE_SCRIPT)
+        self.reload_config()
     
-    def _initialize_encryption_key(self):
-        """Initialize or load encryption key for sensitive data"""
+    def reload_config(self):
+        """
+        Read the SECURITY settings used by the checks
+        
+        They are kept on the instance so the per-request checks don't walk
+        the config dicts; call this again after changing SECURITY at runtime.
+        """
+        self._encryption_enabled = SECURITY["api_key_encryption"]
+        self._rate_limit_enabled = SECURITY["rate_limiting"]["enabled"]
+        self._max_requests = SECURITY["rate_limiting"]["max_requests_per_minute"]
+        self._max_login_attempts = SECURITY["max_login_attempts"]
+        
+        # Bind the encryption methods for the setting once, instead of each
+        # call checking it: disabled shadows them with pass-throughs on the
+        # instance, enabled removes any shadowing
+        for name in _ENCRYPTION_METHODS:
+            if self._encryption_enabled:
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, _passthrough)
+    
+    @functools.cached_property
+    def key(self):
+        """
+        Encryption key for sensitive data, loaded or generated on first use
+        
+        Nothing touches the key file until something is encrypted or
+        decrypted, so creating the manager (at import) costs no disk I/O.
+        """
         key_file = ".encryption_key"
-        if os.path.exists(key_file):
+        try:
             with open(key_file, "rb") as f:
-                self.key = f.read()
-        else:
-            # Generate a new key
-            self.key = Fernet.generate_key()
-            # Save the key (in production, store this securely)
-            with open(key_file, "wb") as f:
-                f.write(self.key)
+                return f.read()
+        except FileNotFoundError:
+            pass
         
-        self.cipher = Fernet(self.key)
+        # Generate a new key
+        key = Fernet.generate_key()
+        # Save the key (in production, store this securely). It is written to
+        # a private temp file and linked into place, which fails if another
+        # process (e.g. a second worker starting) got there first; the loser
+        # reads the winner's key instead of overwriting it, and the key file
+        # is never seen half-written
+        fd, tmp_key_file = tempfile.mkstemp(dir=".", prefix=key_file + ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(key)
+            os.link(tmp_key_file, key_file)
+        except FileExistsError:
+            with open(key_file, "rb") as f:
+                return f.read()
+        finally:
+            os.unlink(tmp_key_file)
+        return key
+    
+    @functools.cached_property
+    def cipher(self):
+        """Fernet cipher for the key, built on first use and then reused"""
+        return _RFernetCipher(self.key) if rfernet is not None else Fernet(self.key)
+    
+    @functools.cached_property
+    def _raw_keys(self):
+        """Fernet's (signing, encryption) key halves, for the raw token methods"""
+        raw_key = base64.urlsafe_b64decode(self.key)
+        return raw_key[:16], raw_key[16:]
+    
+    def _derive_key(self, info):
+        """32-byte key for one purpose, derived from the Fernet key by HKDF-SHA256"""
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(self.key)
+    
+    @functools.cached_property
+    def _bulk_cipher(self):
+        """AES-256-GCM cipher for the bulk methods"""
+        return AESGCM(self._derive_key(_BULK_KEY_INFO))
+    
+    @functools.cached_property
+    def _csrf_secret(self):
+        """Key for CSRF tokens; derived from the key file, so every worker shares it"""
+        return self._derive_key(_CSRF_KEY_INFO)
     
     def encrypt_data(self, data):
         """Encrypt sensitive data"""
-        if not SECURITY["api_key_encryption"]:
-            return data
-            
         if isinstance(data, str):
             data = data.encode()
         encrypted_data = self.cipher.encrypt(data)
@@ -42,45 +269,141 @@ class SecurityManager:
     
     def decrypt_data(self, encrypted_data):
         """Decrypt sensitive data"""
-        if not SECURITY["api_key_encryption"]:
-            return encrypted_data
-            
         if isinstance(encrypted_data, str):
             encrypted_data = encrypted_data.encode()
         decrypted_data = self.cipher.decrypt(encrypted_data)
         return decrypted_data.decode()
     
+    def encrypt_data_raw(self, data):
+        """
+        Encrypt sensitive data into a binary Fernet token
+        
+        For ciphertext that stays inside this process or goes into binary
+        storage: the token is Fernet's, minus the base64 envelope that
+        encrypt_data adds, which saves encoding it here and decoding it in
+        decrypt_data_raw.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        padded_data = padder.update(data) + padder.finalize()
+        signing_key, encryption_key = self._raw_keys
+        iv = os.urandom(16)
+        encryptor = Cipher(algorithms.AES(encryption_key), modes.CBC(iv)).encryptor()
+        ciphertext = encryptor.update(padded_data) + encryptor.finalize()
+        
+        signed = _FERNET_VERSION + struct.pack(">Q", int(time.time())) + iv + ciphertext
+        return signed + hmac.new(signing_key, signed, hashlib.sha256).digest()
+    
+    def decrypt_data_raw(self, token):
+        """
+        Decrypt a binary token from encrypt_data_raw
+        
+        Raises:
+            InvalidToken: If the token is malformed or fails authentication
+        """
+        if len(token) < _FERNET_HEADER_SIZE + _FERNET_HMAC_SIZE or token[:1] != _FERNET_VERSION:
+            raise InvalidToken
+        signing_key, encryption_key = self._raw_keys
+        signed, mac = token[:-_FERNET_HMAC_SIZE], token[-_FERNET_HMAC_SIZE:]
+        if not hmac.compare_digest(hmac.new(signing_key, signed, hashlib.sha256).digest(), mac):
+            raise InvalidToken
+        
+        iv = signed[9:_FERNET_HEADER_SIZE]
+        decryptor = Cipher(algorithms.AES(encryption_key), modes.CBC(iv)).decryptor()
+        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        try:
+            padded_data = decryptor.update(signed[_FERNET_HEADER_SIZE:]) + decryptor.finalize()
+            data = unpadder.update(padded_data) + unpadder.finalize()
+        except ValueError:
+            raise InvalidToken
+        return data.decode()
+    
+    def encrypt_bulk(self, data):
+        """
+        Encrypt a large blob with AES-256-GCM
+        
+        For payloads of more than a few KB, where Fernet's CBC + HMAC passes
+        and base64 envelope dominate: GCM encrypts and authenticates in one
+        OpenSSL (AES-NI) pass. Tokens only decrypt with decrypt_bulk.
+        
+        Args:
+            data (bytes or str): The data to encrypt
+            
+        Returns:
+            bytes: The nonce followed by the ciphertext and tag
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        nonce = os.urandom(_BULK_NONCE_SIZE)
+        return nonce + self._bulk_cipher.encrypt(nonce, data, None)
+    
+    def decrypt_bulk(self, token):
+        """
+        Decrypt a token from encrypt_bulk
+        
+        Returns:
+            bytes: The decrypted data, as blobs need not be text
+            
+        Raises:
+            InvalidToken: If the token is malformed or fails authentication
+        """
+        try:
+            return self._bulk_cipher.decrypt(token[:_BULK_NONCE_SIZE], token[_BULK_NONCE_SIZE:], None)
+        except (InvalidTag, ValueError):
+            raise InvalidToken
+    
     def rate_limit_check(self, ip_address):
         """
         Check if a request should be rate limited
         
+        Each IP has a token bucket holding up to max_requests_per_minute
+        tokens, refilled continuously over a minute; a request takes one.
+        Only [tokens, last refill time] is stored per IP, however many
+        requests it makes.
+        
         Args:
             ip_address (str): The requester's IP address
             
         Returns:
             bool: True if allowed, False if rate limited
         """
-        if not SECURITY["rate_limiting"]["enabled"]:
+        if not self._rate_limit_enabled:
             return True
-            
-        current_time = time.time()
-        max_requests = SECURITY["rate_limiting"]["max_requests_per_minute"]
         
-        # Initialize if this is a new IP
-        if ip_address not in self.request_log:
-            self.request_log[ip_address] = []
+        if self._redis is not None:
+            return self._redis_rate_limit(
+                keys=[f"{REDIS_KEY_PREFIX}rate:{ip_address}"],
+                args=[self._max_requests]
+            ) == 1
         
-        # Clean up old requests (older than 1 minute)
-        self.request_log[ip_address] = [t for t in self.request_log[ip_address] 
-                                        if current_time - t < 60]
+        self._maybe_sweep()
+            
+        max_requests = self._max_requests
         
-        # Check if limit exceeded
-        if len(self.request_log[ip_address]) >= max_requests:
-            return False
+        with self._stripe(ip_address):
+            # Monotonic, so wall-clock adjustments can't empty or refill buckets
+            current_time = time.monotonic()
             
-        # Log the request
-        self.request_log[ip_address].append(current_time)
-        return True
+            # A new IP starts with a full bucket
+            bucket = self.request_log.get(ip_address)
+            if bucket is None:
+                bucket = self.request_log[ip_address] = [max_requests, current_time]
+            else:
+                self.request_log.move_to_end(ip_address)
+            
+            # Refill for the time since the last request, up to the limit
+            tokens = min(max_requests, bucket[0] + (current_time - bucket[1]) * max_requests / 60)
+            bucket[1] = current_time
+            
+            # Check if limit exceeded
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+                
+            # Take a token for this request
+            bucket[0] = tokens - 1
+            return True
     
     def validate_login_attempt(self, username, ip_address):
         """
@@ -93,71 +416,184 @@ class SecurityManager:
         Returns:
             bool: True if allowed, False if too many failed attempts
         """
-        key = f"{username}:{ip_address}"
-        max_attempts = SECURITY["max_login_attempts"]
+        if self._redis is not None:
+            return self._redis_validate_login(
+                keys=self._redis_login_keys(username, ip_address),
+                args=[self._max_login_attempts, LOGIN_LOCKOUT_SECONDS]
+            ) == 1
         
-        if key not in self.login_attempts:
-            self.login_attempts[key] = {"count": 0, "lockout_until": None}
-            
-        # Check if currently locked out
-        if (self.login_attempts[key]["lockout_until"] and 
-            datetime.now() < self.login_attempts[key]["lockout_until"]):
-            return False
-            
-        # Reset lockout if it has expired
-        if (self.login_attempts[key]["lockout_until"] and 
-            datetime.now() >= self.login_attempts[key]["lockout_until"]):
-            self.login_attempts[key] = {"count": 0, "lockout_until": None}
+        self._maybe_sweep()
+        
+        # Tuple keys hash their (cached) string hashes and can't collide the
+        # way "user:ip" strings can when a username contains ":"
+        key = (username, ip_address)
+        max_attempts = self._max_login_attempts
+        
+        with self._stripe(key):
+            # Monotonic, so wall-clock adjustments can't lift or extend a lockout
+            current_time = time.monotonic()
             
-        # Check if max attempts reached
-        if self.login_attempts[key]["count"] >= max_attempts:
-            # Lock for 15 minutes
-            self.login_attempts[key]["lockout_until"] = datetime.now() + timedelta(minutes=15)
-            return False
+            attempts = self.login_attempts.get(key)
+            if attempts is None:
+                attempts = self.login_attempts[key] = {"count": 0, "lockout_until": None}
             
-        return True
+            lockout_until = attempts["lockout_until"]
+            if lockout_until:
+                # Check if currently locked out
+                if current_time < lockout_until:
+                    return False
+                
+                # Reset lockout if it has expired
+                attempts = self.login_attempts[key] = {"count": 0, "lockout_until": None}
+                
+            # Check if max attempts reached
+            if attempts["count"] >= max_attempts:
+                attempts["lockout_until"] = current_time + LOGIN_LOCKOUT_SECONDS
+                return False
+                
+            return True
     
     def record_failed_login(self, username, ip_address):
         """Record a failed login attempt"""
-        key = f"{username}:{ip_address}"
+        if self._redis is not None:
+            self._redis_record_failure(
+                keys=self._redis_login_keys(username, ip_address),
+                args=[FAILED_LOGIN_TTL]
+            )
+            return
         
-        if key not in self.login_attempts:
-            self.login_attempts[key] = {"count": 0, "lockout_until": None}
-            
-        self.login_attempts[key]["count"] += 1
+        key = (username, ip_address)
+        
+        with self._stripe(key):
+            attempts = self.login_attempts.get(key)
+            if attempts is None:
+                attempts = self.login_attempts[key] = {"count": 0, "lockout_until": None}
+                
+            attempts["count"] += 1
+            attempts["last_failure"] = time.monotonic()
     
     def reset_login_attempts(self, username, ip_address):
         """Reset login attempts after successful login"""
-        key = f"{username}:{ip_address}"
+        if self._redis is not None:
+            self._redis.delete(*self._redis_login_keys(username, ip_address))
+            return
+        
+        key = (username, ip_address)
+        
+        with self._stripe(key):
+            if key in self.login_attempts:
+                self.login_attempts[key] = {"count": 0, "lockout_until": None}
+    
+    def _redis_login_keys(self, username, ip_address):
+        """Redis keys for a user/IP pair's failure count and lockout flag"""
+        # Length-prefixed, since usernames and IPv6 addresses both contain ":"
+        base = f"{REDIS_KEY_PREFIX}login:{len(username)}:{username}:{ip_address}"
+        return [f"{base}:count", f"{base}:lockout"]
+    
+    def _stripe(self, key):
+        """Lock guarding the rate-limit or login state stored under key"""
+        return self._stripes[hash(key) % LOCK_STRIPES]
+    
+    def _maybe_sweep(self):
+        """Count a check, sweeping idle state every STATE_SWEEP_INTERVAL checks"""
+        # Unlocked: an increment lost to a racing thread only delays the sweep
+        self._sweep_counter += 1
+        if self._sweep_counter >= STATE_SWEEP_INTERVAL:
+            self._sweep_counter = 0
+            self.sweep_idle_state()
+    
+    def sweep_idle_state(self):
+        """
+        Drop rate-limit and login entries that no longer affect any check
         
-        if key in self.login_attempts:
-            self.login_attempts[key] = {"count": 0, "lockout_until": None}
+        Entries are otherwise kept forever for every IP and username seen. A
+        bucket idle for a minute has refilled, so it acts like a new IP's; a
+        login entry with no lockout in force and no failure within
+        FAILED_LOGIN_TTL acts like a user who never failed.
+        
+        Holds every stripe lock while it runs, so no check sees an entry
+        disappear halfway through.
+        """
+        for lock in self._stripes:
+            lock.acquire()
+        try:
+            current_time = time.monotonic()
+            request_log = self.request_log
+            while request_log:
+                # Oldest first; checks racing on other stripes can leave an
+                # idle IP behind a newer one, which only delays its removal
+                if current_time - next(iter(request_log.values()))[1] < 60:
+                    break
+                request_log.popitem(last=False)
+            
+            for key, attempts in list(self.login_attempts.items()):
+                lockout_until = attempts["lockout_until"]
+                if lockout_until:
+                    # An expired lockout is reset on the next check anyway
+                    expired = current_time >= lockout_until
+                else:
+                    last_failure = attempts.get("last_failure")
+                    expired = last_failure is None or current_time - last_failure >= FAILED_LOGIN_TTL
+                if expired:
+                    del self.login_attempts[key]
+        finally:
+            for lock in self._stripes:
+                lock.release()
     
-    def generate_csrf_token(self):
-        """Generate a CSRF token for form protection"""
-        return secrets.token_hex(32)
+    def generate_csrf_token(self, session_id):
+        """
+        Generate a CSRF token for form protection
+        
+        The token is a keyed hash (MAC) of the session ID, so nothing is
+        stored per session: validation recomputes it.
+        
+        Args:
+            session_id (str): The session the form is rendered for
+            
+        Returns:
+            str: 256-bit token as 43 URL-safe characters
+        """
+        message = str(session_id).encode()
+        if _blake2b is not None:
+            digest = _blake2b(message, key=self._csrf_secret, digest_size=32).digest()
+        else:
+            digest = hmac.new(self._csrf_secret, message, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
     
-    def validate_csrf_token(self, session_token, form_token):
-        """Validate a CSRF token"""
-        if not session_token or not form_token:
+    def validate_csrf_token(self, session_id, form_token):
+        """
+        Validate a CSRF token
+        
+        Args:
+            session_id (str): The session the form was submitted in
+            form_token (str): The token sent back with the form
+            
+        Returns:
+            bool: True if the token was generated for this session
+        """
+        if not session_id or not form_token:
+            return False
+        # Compare bytes, since compare_digest rejects non-ASCII str (e.g. a
+        # tampered form value)
+        expected = self.generate_csrf_token(session_id).encode()
+        actual = str(form_token).encode()
+        # Token length is public, so a mismatch can be rejected outright;
+        # same-length tokens still get the constant-time comparison
+        if len(expected) != len(actual):
             return False
-        return hmac.compare_digest(session_token, form_token)
+        return hmac.compare_digest(expected, actual)
     
     def sanitize_input(self, user_input):
         """Basic sanitization of user input"""
         if not user_input:
             return ""
             
-        # Remove potentially dangerous characters
-        sanitized = user_input.replace("<", "&lt;").replace(">", "&gt;")
-        sanitized = sanitized.replace("'", "&#39;").replace('"', "&quot;")
-        sanitized = sanitized.replace(";", "&#59;")
-        
-        return sanitized
+        # Escape potentially dangerous characters in a single pass
+        return user_input.translate(_SANITIZE_TABLE)
     
     def get_secure_headers(self):
-        """Get security headers for responses"""
-        return SECURITY["headers"]
+        """Get security headers for responses (a shared, read-only mapping)"""
+        return _SECURE_HEADERS
 
 # Initialize global security manager
 security_manager = SecurityManager() 
\ No newline at end of file